@@ -32,6 +32,7 @@
 
 # Imports all lenses
 from util_lenses import *
+from parallel import parallel_get, parallel_split_get, NON_INDENTED_LINE
 
 
 # Some lens abbreviations, for short-hand lens definitions.
@@ -53,13 +54,57 @@ def get(lens, *args, **kargs) :
   lens.
 
   Example: get(some_lens, "a=1,c=4") -> {"a":1, "c":4}
+
+  Settings for a single call may be given in a LensContext, for example:
+  get(some_lens, "a=1,c=4", context=LensContext(check_consumption=False))
   """
-  lens = Lens._coerce_to_lens(lens)
-  # Wrap in AutoGroup, so outer container may be ommitted for convenience
-  # (usually of testing lens fragments)
-  if not lens.has_type() :
-    lens = AutoGroup(lens)
-  return lens.get(*args, **kargs)
+  return _get_outer_lens(lens).get(*args, **kargs)
+
+def get_many(lens, concrete_inputs, workers=None, chunk_size=1, ordered=True) :
+  """
+  GETs a python structure from each of many strings, parsing them in parallel
+  in a pool of worker processes.
+
+  The lens is shipped to each worker just once, so it must be picklable (e.g.
+  any LensObject classes must be defined at module level).  The items are
+  returned with the same meta data as from get(), so may later be PUT.
+
+  Arguments:
+    workers - the number of worker processes (defaults to the number of CPUs);
+    if 1, the strings are simply parsed in this process.
+    chunk_size - the number of strings sent to a worker at a time.
+    ordered - if True, a list of items is returned in the order of the
+    strings; otherwise, (index, item) pairs are yielded as they are parsed,
+    index being that of the string in concrete_inputs.  If you may stop
+    before all are yielded, use the result in a 'with' statement (or call its
+    close()), so the worker processes are terminated promptly.
+
+  Example: get_many(some_lens, ["a=1", "c=4"]) -> [{"a":1}, {"c":4}]
+  """
+  return parallel_get(_get_outer_lens(lens), concrete_inputs, workers=workers, chunk_size=chunk_size, ordered=ordered)
+
+def get_split(lens, concrete_input, boundary=NON_INDENTED_LINE, workers=None, chunk_count=None) :
+  """
+  GETs a python structure from a single (large) string of records, parsing
+  chunks of the string in parallel in a pool of worker processes.
+
+  The lens must be of the form Repeat(record) (e.g. ZeroOrMore(record)),
+  optionally within a Group (e.g. a LensObject class).  The string is split
+  into chunks where the boundary regex matches, which should be where records
+  may start, and the records of each chunk are GOT in a worker.  If a chunk
+  cannot be parsed alone (e.g. if a record spans a boundary) it is parsed
+  sequentially, with its neighbours if necessary, so the result is always as
+  from get(), provided records are not changed by where they were split.
+
+  Arguments:
+    boundary - a regex (string or compiled) that matches where records may
+    start; by default, the start of any non-indented line.  To start records
+    at a keyword, for example: r"^iface\b"
+    workers - the number of worker processes (defaults to the number of CPUs).
+    chunk_count - how many chunks to split the string into (defaults to four
+    per worker).
+  """
+  return parallel_split_get(_get_outer_lens(lens), concrete_input, boundary=boundary, workers=workers, chunk_count=chunk_count)
 
 def put(lens_or_instance, *args, **kargs) :
   """
@@ -75,13 +120,72 @@ def put(lens_or_instance, *args, **kargs) :
     return lens.put(instance, *args, **kargs)
   
   # Otherwise...
-  lens = Lens._coerce_to_lens(lens_or_instance)
+  # We assume above that instance will be wrapped in an appropriately typed
+  # group, so only wrap lenses here.
+  return _get_outer_lens(lens_or_instance).put(*args, **kargs)
+
+
+def get_from(lens, source, **kargs) :
+  """
+  As get(), but reads the string from the source, which may be a string, a
+  file-like object or an iterable of string chunks (e.g. as they arrive from a
+  socket or remote shell).
+
+  Example: get_from(some_lens, open("/etc/hosts"))
+  """
+  return get(lens, read_source(source), **kargs)
+
+def put_to(writer, lens_or_instance, *args, **kargs) :
+  """
+  As put(), but writes the output to the writer, a file-like object or any
+  object with a write(string) method, returning the output.
+  """
+  output = put(lens_or_instance, *args, **kargs)
+  writer.write(output)
+  return output
+
+def get_in_executor(executor, lens, source, **kargs) :
+  """
+  Submits a GET from the source (see get_from()) to an executor, such as a
+  concurrent.futures executor, returning its future.  So that long parses do
+  not block an event loop, the future may be awaited: e.g. with asyncio's
+  wrap_future().
+  """
+  return executor.submit(get_from, lens, source, **kargs)
+
+def put_in_executor(executor, lens_or_instance, *args, **kargs) :
+  """
+  Submits a PUT to an executor (see get_in_executor()), returning its future.
+  To write the output rather than return it, pass a writer keyword argument,
+  as for put_to().
+  """
+  writer = kargs.pop("writer", None)
+  if writer :
+    return executor.submit(put_to, writer, lens_or_instance, *args, **kargs)
+  return executor.submit(put, lens_or_instance, *args, **kargs)
+
+def read_source(source) :
+  """Reads a whole string from a string, file-like object or iterable of string chunks."""
+  if isinstance(source, basestring) :
+    return source
+  if hasattr(source, "read") :
+    return source.read()
+  return "".join(source)
+
+
+def _get_outer_lens(lens) :
+  """Coerces the lens for GET or PUT, wrapping it in a container if it has none."""
+  lens = Lens._coerce_to_lens(lens)
   # Wrap in AutoGroup, so outer container may be ommitted for convenience
-  # (usually of testing lens fragments). We assume above that instance will be
-  # wrapped in am appropriately typed group, so only do this here.
+  # (usually of testing lens fragments).  The wrapper is kept on the lens, so
+  # that the same one is used by each call.
   if not lens.has_type() :
-    lens = AutoGroup(lens)
-  return lens.put(*args, **kargs)
+    if not isinstance(getattr(lens, "_auto_group", None), AutoGroup) :
+      lens._auto_group = AutoGroup(lens)
+      if lens.is_frozen() :
+        lens._auto_group.freeze()
+    lens = lens._auto_group
+  return lens
 
 
 ###########################
@@ -32,6 +32,7 @@
 """Contains base lenses, from which all other lenses are derived."""
 
 import inspect
+import weakref
 
 from debug import *
 from settings import *
@@ -41,6 +42,34 @@ from readers import *
 from item import *
 from util import *
 from charsets import *
+from context import *
+
+
+# Lenses shared between frozen lens graphs, keyed by their structure (see
+# Lens._get_structural_key()).
+_interned_lenses = weakref.WeakValueDictionary()
+
+class _derived_attribute(object) :
+  """
+  Declares an attribute of a lens derived from its definition, which is
+  computed whenever read, unless the lens has been frozen, whereupon it is
+  computed once and stored on the lens (which, since this is not a data
+  descriptor, then takes precedence).
+  """
+
+  def __init__(self, function) :
+    self.function = function
+
+  def __get__(self, lens, lens_class) :
+    if lens == None :
+      return self
+    return self.function(lens)
+
+def _get_typed_key(value) :
+  """Returns a key of the value that also distinguishes equal values of differing types."""
+  if isinstance(value, tuple) :
+    return (tuple, tuple([_get_typed_key(element) for element in value]))
+  return (type(value), value)
 
 
 #########################################################
@@ -50,6 +79,13 @@ from charsets import *
 class Lens(object) :
   """Base lens, which handles most of the complexity."""
   
+  # Set by freeze(), after which the lens may not be changed.
+  _frozen = False
+
+  # Attributes that may still be set on a frozen lens, since they only cache
+  # things derived from it.
+  _CACHE_ATTRIBUTES = ["_auto_group"]
+
   def __init__(self, type=None, name=None, default=None, **kargs) :
     # Set python type of this lens.  If a lens has a type it is effectively a
     # STORE lens, as described in the literature.
@@ -84,7 +120,7 @@ class Lens(object) :
 
 
 
-  def get(self, concrete_input, current_container=None) :
+  def get(self, concrete_input, current_container=None, context=None) :
     """
     The top-level API function to extract a python structure from a given
     string with this lens.
@@ -92,6 +128,8 @@ class Lens(object) :
     Arguments:
       concrete_input - concrete string or stateful concrete input reader
       current_container - outer container into which items are being extracted
+      context - a LensContext holding the state and settings of this call,
+      which is otherwise inherited from an outer lens or created afresh.
 
     This effectively wraps the _get function (GET proper) of the specific
     lens, handling all of the common tasks (e.g. input normalisation, creation
@@ -117,6 +155,14 @@ class Lens(object) :
     #
     # return item
 
+    # Ensure that this call, and those of any sub-lenses, run within a context
+    # that holds the state of the call, creating one if we are the outermost
+    # lens and none was passed to us.
+    current_context = get_current_context()
+    if current_context == None or (has_value(context) and context is not current_context) :
+      with lens_context(context or LensContext()) :
+        return self.get(concrete_input, current_container)
+
     # Ensure we have the concrete input in the form of a ConcreteInputReader
     assert_msg(has_value(concrete_input), "Cannot GET if there is no input string!")
     concrete_input_reader = self._normalise_concrete_input(concrete_input)
@@ -158,7 +204,7 @@ class Lens(object) :
       item = self._get(concrete_input_reader, current_container)
 
     # If we are a STORE lens (i.e. we extract an item) ...
-    if self.has_type() :
+    if self._has_type :
       
       # Cast the item to our type (usually if it is a string being cast to a
       # simple type, such as int).
@@ -179,10 +225,10 @@ class Lens(object) :
       item._meta_data.lens = self
       d("Set meta on %s to %s" % (item, item._meta_data))
 
-      # A reference to the concrete reader and position parsed from.
+      # A reference to the concrete document and positions parsed from.
       item._meta_data.concrete_start_position = concrete_start_position
       item._meta_data.concrete_end_position = concrete_input_reader.get_pos()
-      item._meta_data.concrete_input_reader = concrete_input_reader
+      item._meta_data.concrete_document = concrete_input_reader.document
 
       # If the item was unwrapped from a container, update meta with label
       # from the container, which may have been set if there was an is_label
@@ -200,7 +246,7 @@ class Lens(object) :
         d("GOT: NOTHING (to store)")
   
     # If appropriate, check the input was fully consumed by this lens
-    if isinstance(concrete_input, str) and GlobalSettings.check_consumption and not concrete_input_reader.is_fully_consumed() :
+    if isinstance(concrete_input, str) and current_context.check_consumption and not concrete_input_reader.is_fully_consumed() :
       raise NotFullyConsumedException("The following input remains to be consumed by this lens: '%s'" % concrete_input_reader.get_remaining())
 
     # Pre-process outgoing item.
@@ -209,7 +255,7 @@ class Lens(object) :
     return item
 
 
-  def put(self, item=None, concrete_input=None, current_container=None, label=None) :
+  def put(self, item=None, concrete_input=None, current_container=None, label=None, context=None) :
     """
     The top-level API function to PUT a python structure back into a string
     structure.  This function holds much of the framework's complexity.
@@ -221,6 +267,7 @@ class Lens(object) :
       and PUT back
       label - allows the user to set a label on the passed item, to allow for
       structures that internally contain a label.
+      context - as for get().
 
     This effectively wraps the _put function (PUT proper) of the specific
     lens, handling all of the common tasks (e.g. input normalisation, creation
@@ -280,6 +327,12 @@ class Lens(object) :
     #  Should have returned by here, so raise LensException: expected something to put.
     #
 
+    # As in get(), ensure we are running within a context.
+    current_context = get_current_context()
+    if current_context == None or (has_value(context) and context is not current_context) :
+      with lens_context(context or LensContext()) :
+        return self.put(item, concrete_input, current_container, label)
+
     # If we are passed an item, we do not expect an outer container to also have
     # been passed.
     if has_value(item) :
@@ -316,7 +369,7 @@ class Lens(object) :
     # either return the default output string, if it has one; or it will
     # generate some output internally, perhaps from the input or from the
     # default output of a sub-lens.
-    if not self.has_type() :
+    if not self._has_type :
       # Use default (for CREATE)
       if concrete_input_reader == None and has_value(self.default) :
         output = str(self.default)
@@ -358,15 +411,20 @@ class Lens(object) :
         raise LensException("This lens %s of type %s cannot PUT an item of that type %s" % (self, self.type, type(item)))
       
       # If this item was previously GOTten, we can get its original input.
-      if has_value(item._meta_data.concrete_input_reader) :
+      if has_value(item._meta_data.concrete_document) :
         
-        # Create a personal concrete reader for this item, based on its meta
-        # data.
-        item_input_reader = ConcreteInputReader(item._meta_data.concrete_input_reader)
-        item_input_reader.set_pos(item._meta_data.concrete_start_position)
+        # Remember the span of the item's original input for the rest of this
+        # PUT, should the lens that GOT it later discard that input into the
+        # kind of container we are PUTting it from.
+        record_concrete_span(item._meta_data.lens, item._meta_data.concrete_document, item._meta_data.concrete_start_position, item._meta_data.concrete_end_position, current_container)
+
+        # If the outer reader is not aligned with the item's original input...
+        if not(has_value(concrete_input_reader) and concrete_input_reader.is_at(item._meta_data.concrete_document, item._meta_data.concrete_start_position)) :
+          # Create a personal concrete reader for this item, based on its meta
+          # data.
+          item_input_reader = ConcreteInputReader(item._meta_data.concrete_document)
+          item_input_reader.set_pos(item._meta_data.concrete_start_position)
 
-        # If the readers are not aligned...
-        if not(has_value(concrete_input_reader) and item_input_reader.is_aligned_with(concrete_input_reader)) :
           # Consumed from the outer reader, if there is one.
           if has_value(concrete_input_reader) :
             d("Inputs not aligned, so consuming and discarding from outer input reader.")
@@ -411,7 +469,7 @@ class Lens(object) :
         output = self._put(item, concrete_input_reader, current_container)
 
         # Check the container items have been fully consumed by this lens.
-        if has_value(item_as_container) and GlobalSettings.check_consumption and not current_container.is_fully_consumed() :
+        if has_value(item_as_container) and current_context.check_consumption and not current_container.is_fully_consumed() :
           raise NotFullyConsumedException("The container %s has not been fully consumed." % current_container)
       finally:
         # Now recover the original state of the item, including its meta data,
@@ -419,6 +477,7 @@ class Lens(object) :
         original_item._meta_data = original_meta_data
         if isinstance(original_item, Rollbackable) :
           original_item._set_state(original_state)
+          original_item._forget_earlier_states()
         
         
    
@@ -441,7 +500,7 @@ class Lens(object) :
         d("PUT: NOTHING")
 
     # If appropriate, check the input was fully consumed by this lens
-    if isinstance(concrete_input, str) and GlobalSettings.check_consumption and not original_concrete_input_reader.is_fully_consumed() :
+    if isinstance(concrete_input, str) and current_context.check_consumption and not original_concrete_input_reader.is_fully_consumed() :
       raise NotFullyConsumedException("The following input remains to be consumed by this lens: '%s'" % original_concrete_input_reader.get_remaining())
 
     return output
@@ -455,16 +514,48 @@ class Lens(object) :
     one day use the current container state, so we must first store items in the
     container before reverting it.  For example, the opening and closing tags in
     XML-like structures.
+
+    If, during the current GET or PUT, this lens is known to have GOT input from
+    the same position into the same kind of container (e.g. the input of an
+    item being PUT, or input already discarded), we simply skip over the input
+    that it consumed.  Similarly, if the lens has already failed to discard
+    input from this position into such a container (e.g. as each alternative
+    of nested Or lenses is tried), we fail straight away.
     """
+    concrete_input_reader = self._normalise_concrete_input(concrete_input)
+    start_position = concrete_input_reader.get_pos()
+
+    current_context = get_current_context()
+    failed_discards = None
+    if has_value(current_context) :
+      discard_key = get_discard_key(self, concrete_input_reader.document, start_position, current_container)
+      end_position = current_context.caches.get(CONCRETE_SPANS, {}).get(discard_key)
+      if has_value(end_position) :
+        d("Skipping input previously GOT by this lens.")
+        concrete_input_reader.set_pos(end_position)
+        return
+
+      failed_discards = current_context.caches.setdefault(FAILED_DISCARDS, set())
+      if discard_key in failed_discards :
+        raise LensException("This lens has already failed to GET input from here.")
+
     # If we have a container, store its start state.
     if has_value(current_container): container_start_state = current_container._get_state()
 
-    # Issue the get.
-    self.get(concrete_input, current_container)
+    # Issue the get, remembering if it fails.
+    try :
+      self.get(concrete_input_reader, current_container)
+    except LensException :
+      if has_value(failed_discards) :
+        failed_discards.add(discard_key)
+      raise
     
     # Now revert the state.
     if has_value(current_container): current_container._set_state(container_start_state)
 
+    # Record the span, should we discard this input again.
+    record_concrete_span(self, concrete_input_reader.document, start_position, concrete_input_reader.get_pos(), current_container)
+
   
 
   def has_type(self) :
@@ -472,6 +563,217 @@ class Lens(object) :
     return self.type != None
 
 
+  #
+  # Freezing, to fix the definition of a lens before it is used.
+  #
+
+  def freeze(self) :
+    """
+    Validates this lens and its sub-lenses, then prevents them from being
+    changed, such that attributes used on every GET and PUT (e.g. the lens'
+    container class and options) may be computed once, rather than on each
+    call.  Returns the lens, for convenience: e.g. lens = Group(...).freeze()
+
+    Note, a lens is simply shared if it is a sub-lens of another, so that may
+    not be changed either.
+    """
+    lenses = [lens for lens in self._iterate_lenses() if not lens._frozen]
+    for lens in lenses :
+      lens._validate()
+    
+    # Share sub-lenses with those of identical structure in other frozen
+    # lenses, which may no longer be part of our graph.
+    self._intern_sublenses({})
+    lenses = [lens for lens in self._iterate_lenses() if not lens._frozen]
+
+    for lens in lenses :
+      lens._precompute()
+      lens.__dict__["options"] = FrozenProperties(**lens.options.unwrap())
+      lens.__dict__["lenses"] = tuple(lens.lenses)
+      lens.__dict__["_frozen"] = True
+    
+    return self
+
+  def is_frozen(self) :
+    return self._frozen
+
+  
+  #
+  # Optimisation, to simplify a lens graph built up from operators.
+  #
+
+  def optimise(self) :
+    """
+    Rewrites this lens and its sub-lenses into an equivalent but simpler
+    lens, which will GET, PUT and CREATE as before: for example, by
+    flattening nested Ands and Ors, and merging adjacent Literals.  Returns
+    the simplified lens, which may not be this one (e.g. if this is an And of
+    a single lens), so use: lens = lens.optimise()
+
+    Note, only lenses that are merely structural (see _is_plain()) are
+    rewritten, so the types, defaults, names and options of lenses are
+    preserved.  Sub-lenses are changed in place, so a lens should be optimised
+    before it is used, and frozen lenses are left alone.
+    """
+    # Simplify sub-lenses before the lenses that contain them.
+    for lens in reversed(list(self._iterate_lenses())) :
+      if not lens._frozen :
+        lens._optimise_sublenses()
+    return self._collapse()
+
+  def _is_plain(self, implicit_default=None) :
+    """
+    Determines if this lens is merely structural (i.e. it stores no item and
+    has no default, name or options), so may be rewritten by optimise().
+    Lenses that set their own default (e.g. Literal) should pass it here.
+    """
+    return not has_value(self.type) and self.default == implicit_default and not self.name and not self.options.unwrap()
+
+  def _has_behaviour_of(self, lens_class) :
+    """Checks that GET and PUT proper of this lens are those of the given class (e.g. not overridden by a subclass)."""
+    return self.__class__._get.im_func is lens_class._get.im_func and self.__class__._put.im_func is lens_class._put.im_func
+
+  def _optimise_sublenses(self) :
+    """Simplifies the sub-lenses of this lens, which lenses may extend with further rules."""
+    self.lenses = [lens._collapse() for lens in self.lenses]
+
+  def _collapse(self) :
+    """Returns a simpler lens equivalent to this one (e.g. the sub-lens of an And of one lens), or this lens."""
+    return self
+
+
+  #
+  # Static analysis of a lens.
+  #
+
+  # Whether a lens may successfully GET without consuming any input.
+  NOT_NULLABLE = "NOT_NULLABLE" # Always consumes some input.
+  NULLABLE     = "NULLABLE"     # May consume no input, or we cannot be sure.
+  ALWAYS_EMPTY = "ALWAYS_EMPTY" # Never consumes any input.
+
+  def get_nullability(self, visiting=None) :
+    """
+    Determines whether this lens may GET (or PUT into) some input without
+    consuming any, returning NOT_NULLABLE, NULLABLE or ALWAYS_EMPTY.
+
+    Note, the analysis errs on the safe side, so if a lens is reached again
+    through recursion it is assumed to be NULLABLE.
+    """
+    # Holds the ids of the lenses we are within, to detect recursion.
+    if visiting == None :
+      visiting = set()
+    if id(self) in visiting :
+      return Lens.NULLABLE
+    
+    visiting.add(id(self))
+    try :
+      return self._get_nullability(visiting)
+    finally :
+      visiting.remove(id(self))
+
+  def _get_nullability(self, visiting) :
+    """Lenses should override this if they can be more precise than NULLABLE."""
+    return Lens.NULLABLE
+
+  def _intern_sublenses(self, interned) :
+    """
+    Replaces, from the bottom up, each sub-lens with an interned lens of
+    identical structure, if there is one, otherwise interning the sub-lens,
+    and returns the lens to use in place of this one.  
+    
+    Note, interned maps the id of each lens visited to the lens that replaces
+    it, which also guards against cycles.
+    """
+    if id(self) in interned :
+      return interned[id(self)]
+    interned[id(self)] = self
+    
+    # Only unfrozen lenses may be changed, and frozen ones were interned when frozen.
+    if self._frozen :
+      return self
+
+    self.lenses = [lens._intern_sublenses(interned) for lens in self.lenses]
+    
+    structural_key = self._get_structural_key()
+    if structural_key == None :
+      return self
+    
+    # Intern ourself, if no identical lens has been.
+    interned_lens = _interned_lenses.setdefault(structural_key, self)
+    interned[id(self)] = interned_lens
+    return interned_lens
+
+  def _get_structural_key(self) :
+    """
+    Returns a key shared by any lens of identical structure, or None if this
+    lens should not be shared: for example, a STORE lens, since the meta data
+    of items refer to the lens that GOT them.
+    """
+    if self.has_type() :
+      return None
+
+    # Since sub-lenses are interned first, identical sub-lenses will be the same lens.
+    # Note, values of differing types may be equal (e.g. 1, 1.0 and True), so
+    # their types are part of the key too.
+    attributes = tuple(sorted([(name, _get_typed_key(value)) for name, value in self.__dict__.iteritems() if not name.startswith("_") and name not in ["lenses", "options"]]))
+    options = tuple(sorted([(name, _get_typed_key(value)) for name, value in self.options.unwrap().iteritems()]))
+    structural_key = (self.__class__, attributes, options, tuple([id(lens) for lens in self.lenses]))
+    
+    # Some lenses may have arguments, such as lists, that cannot be used in a key.
+    try :
+      hash(structural_key)
+    except TypeError :
+      return None
+    return structural_key
+
+  def __setattr__(self, name, value) :
+    if self._frozen and name not in self._CACHE_ATTRIBUTES :
+      raise LensDefinitionException("Cannot set '%s' on %s, since it is frozen." % (name, self))
+    super(Lens, self).__setattr__(name, value)
+
+  def _iterate_lenses(self) :
+    """Yields this lens and each of its sub-lenses (only once, since the graph may have cycles), depth-first."""
+    visited = set()
+    stack = [self]
+    while stack :
+      lens = stack.pop()
+      if id(lens) in visited :
+        continue
+      visited.add(id(lens))
+      yield lens
+      # Reversed, so sub-lenses are visited in order.
+      stack.extend(reversed(lens.lenses))
+
+  def _validate(self) :
+    """
+    Checks the definition of this lens, raising a LensDefinitionException if
+    it is not valid.  Lenses may extend this to check their own arguments.
+    """
+    for lens in self.lenses :
+      if not isinstance(lens, Lens) :
+        raise LensDefinitionException("%s has a sub-lens %s that is not a lens." % (self, lens))
+
+  #
+  # Attributes, derived from the lens' definition, used on every GET and PUT.
+  #
+
+  _has_type = _derived_attribute(lambda self : self.type != None)
+  _container_class = _derived_attribute(lambda self : ContainerFactory.get_container_class(self.type))
+  _is_list_type = _derived_attribute(lambda self : self.type != None and issubclass(self.type, list))
+  _auto_list = _derived_attribute(lambda self : self.options.auto_list == True)
+  _combine_chars = _derived_attribute(lambda self : bool(self.options.combine_chars))
+  _is_label = _derived_attribute(lambda self : bool(self.options.is_label))
+  _label = _derived_attribute(lambda self : self.options.label)
+
+  def _precompute(self) :
+    """
+    Computes, once the lens is frozen, each of its derived attributes.
+    """
+    # Note, we bypass __setattr__, since we may be frozen.
+    for name in ["_has_type", "_container_class", "_is_list_type", "_auto_list", "_combine_chars", "_is_label", "_label"] :
+      self.__dict__[name] = getattr(self, name)
+
+
   def container_get(self, lens, concrete_input_reader, current_container) :
     """
     Convenience function to handle the case where:
@@ -501,6 +803,7 @@ class Lens(object) :
 
   def set_sublens(self, sublens) :
     """Used if only a single sublens is required (e.g. the Forward lens)."""
+    # Note, this will raise if we are frozen.
     self.lenses = [self._preprocess_lens(sublens)]
 
   def extend_sublenses(self, new_sublenses) :
@@ -508,6 +811,8 @@ class Lens(object) :
     Adds new sublenses to this lens, being sure to preprocess them (e.g. convert
     strings to Literal lenses, etc.).
     """
+    if self._frozen :
+      raise LensDefinitionException("Cannot add sub-lenses to %s, since it is frozen." % self)
     for new_sublens in new_sublenses :
       self.lenses.append(self._preprocess_lens(new_sublens))
 
@@ -528,7 +833,11 @@ class Lens(object) :
 
   def _create_lens_container(self):
     """Creates a container for this lens, if the lens is of a container type."""
-    return ContainerFactory.create_container(self.type)
+    container_class = self._container_class
+    if container_class == None :
+      return None
+    # As in ContainerFactory.create_container(), we do not call the constructor.
+    return container_class.__new__(container_class)
 
 
   # XXX: I don't really like these forward declarations, but for now this does
@@ -548,9 +857,19 @@ class Lens(object) :
     # and PUT instances of that class.
     elif inspect.isclass(lens_operand) and issubclass(lens_operand, LensObject) :
       assert_msg(hasattr(lens_operand, "__lens__"), "LensObject %s defines no __lens__ variable" % lens_operand)
+      # The lens is built once per class, then cached in the class' own
+      # __dict__ (so not inherited by subclasses), alongside the __lens__ it
+      # was built from, in case that is later replaced.  Note, we don't use a
+      # weak-keyed dictionary since the lens refers to its class, so the class
+      # would never be released.
+      cached = lens_operand.__dict__.get("_coerced_lens")
+      if cached and cached[0] is lens_operand.__lens__ :
+        return cached[1]
       # Note, we also coerce __lens__ to a lens, just for completeness (e.g. if
       # lens was simply a string, it would be coerced to a Literal lens.
-      lens_operand = Group(Lens._coerce_to_lens(lens_operand.__lens__), type=lens_operand)
+      lens = Group(Lens._coerce_to_lens(lens_operand.__lens__), type=lens_operand)
+      lens_operand._coerced_lens = (lens_operand.__lens__, lens)
+      lens_operand = lens
     
     assert_msg(isinstance(lens_operand, Lens), "Unable to coerce %s to a lens" % lens_operand)
     return lens_operand
@@ -580,7 +899,7 @@ class Lens(object) :
     
     # This allows a list singleton to be returned as a single item, for
     # convenience.
-    if self.options.auto_list == True and self.has_type() and issubclass(self.type, list) and len(item) == 1:
+    if self._auto_list and self._is_list_type and len(item) == 1:
       # The easy part is extracting a singleton from the list, but we must
       # also preserve the source meta data of the list item by piggybacking it onto
       # the extracted item's meta data
@@ -592,7 +911,7 @@ class Lens(object) :
       item._meta_data.singleton_meta_data = singleton_meta_data
     
     # This allows a list of chars to be combined into a string.
-    elif self.options.combine_chars and self.has_type() and issubclass(self.type, list):
+    elif self._combine_chars and self._is_list_type:
       # Note, care should be taken to use this only when a list of single chars is used.
       # XXX: Note, we actually loose each char's meta data here, but this should not be a problem in most cases.
       original_meta = item._meta_data
@@ -600,11 +919,11 @@ class Lens(object) :
       item._meta_data = original_meta
  
     # Mark if this item is to be used AS a label.
-    if self.options.is_label :
+    if self._is_label :
       item._meta_data.is_label = True
     # Mark the item to have a static label.
-    elif has_value(self.options.label) :
-      item._meta_data.label = self.options.label
+    elif has_value(self._label) :
+      item._meta_data.label = self._label
 
     return item
 
@@ -622,7 +941,7 @@ class Lens(object) :
     # - it will try to use the wrong source meta.
 
     # Handle auto_list, expanding an item into a list, being careful to restore any meta data.
-    if self.options.auto_list == True and issubclass(self.type, list) and not isinstance(item, list):
+    if self._auto_list and self._is_list_type and not isinstance(item, list):
 
       # Create some variables to clarify the process.
       singleton = item
@@ -647,7 +966,7 @@ class Lens(object) :
       item._meta_data = item._meta_data.singleton_meta_data
 
     # This allows a list of chars to be combined into a string.
-    elif isinstance(item, str) and self.options.combine_chars and issubclass(self.type, list):
+    elif isinstance(item, str) and self._combine_chars and self._is_list_type:
       # Note, care should be taken to use this only when a list of single chars is used.
       original_meta = item._meta_data
       item = enable_meta_data(list(item))
@@ -738,6 +1057,44 @@ class And(Lens) :
         self.extend_sublenses([lens])
 
 
+  def _optimise_sublenses(self) :
+    super(And, self)._optimise_sublenses()
+    lenses = []
+    for lens in self.lenses :
+      # Flatten structural Ands (e.g. from a Group, or an And subclass such as
+      # List that has no behaviour of its own).
+      if isinstance(lens, And) and lens._is_plain() and lens._has_behaviour_of(And) :
+        new_lenses = lens.lenses
+      else :
+        new_lenses = [lens]
+
+      for new_lens in new_lenses :
+        # Merge adjacent literals, which will GET and PUT the same string.
+        if lenses and Literal._is_plain_literal(lenses[-1]) and Literal._is_plain_literal(new_lens) :
+          lenses[-1] = Literal(lenses[-1].literal_string + new_lens.literal_string)
+        else :
+          lenses.append(new_lens)
+    
+    self.lenses = lenses
+
+  def _collapse(self) :
+    if len(self.lenses) == 1 and self._is_plain() and self._has_behaviour_of(And) :
+      return self.lenses[0]._collapse()
+    return self
+
+  def _get_nullability(self, visiting) :
+    if not self._has_behaviour_of(And) :
+      return super(And, self)._get_nullability(visiting)
+    
+    nullabilities = [lens.get_nullability(visiting) for lens in self.lenses]
+    if all([nullability == Lens.ALWAYS_EMPTY for nullability in nullabilities]) :
+      return Lens.ALWAYS_EMPTY
+    # If any lens consumes input, so must we.
+    if Lens.NOT_NULLABLE in nullabilities :
+      return Lens.NOT_NULLABLE
+    return Lens.NULLABLE
+
+
   def _get(self, concrete_input_reader, current_container) :
     """Sequential GET on each lens."""
     for lens in self.lenses :
@@ -812,6 +1169,47 @@ class Or(Lens) :
         self.extend_sublenses([lens])
 
 
+  def _optimise_sublenses(self) :
+    super(Or, self)._optimise_sublenses()
+    lenses = []
+    for lens in self.lenses :
+      # Flatten structural Ors (e.g. Optional), as does our constructor.
+      if isinstance(lens, Or) and lens._is_plain() and lens._has_behaviour_of(Or) :
+        new_lenses = lens.lenses
+      else :
+        new_lenses = [lens]
+
+      for new_lens in new_lenses :
+        # An alternative identical to an Empty lens that comes before it will
+        # never do any more than that lens.
+        if isinstance(new_lens, Empty) and new_lens._is_plain(implicit_default="") and \
+          [other for other in lenses if isinstance(other, Empty) and other._is_plain(implicit_default="") and other.mode == new_lens.mode] :
+          continue
+        
+        # Adjacent alternative sets of chars are simply a larger set.
+        if lenses and AnyOf._can_merge(lenses[-1], new_lens) :
+          lenses[-1] = AnyOf._merge(lenses[-1], new_lens)
+        else :
+          lenses.append(new_lens)
+
+    self.lenses = lenses
+
+  def _collapse(self) :
+    if len(self.lenses) == 1 and self._is_plain() and self._has_behaviour_of(Or) :
+      return self.lenses[0]._collapse()
+    return self
+
+  def _get_nullability(self, visiting) :
+    if not self._has_behaviour_of(Or) :
+      return super(Or, self)._get_nullability(visiting)
+    
+    nullabilities = [lens.get_nullability(visiting) for lens in self.lenses]
+    for nullability in [Lens.ALWAYS_EMPTY, Lens.NOT_NULLABLE] :
+      if all([other == nullability for other in nullabilities]) :
+        return nullability
+    return Lens.NULLABLE
+
+
   def _get(self, concrete_input_reader, current_container) :
     """
     Calls get on each lens until the firstmost succeeds.
@@ -819,12 +1217,27 @@ class Or(Lens) :
     Note that the lens should be designed accordingly to break ties over
     multiple valid paths.
     """
-    for lens in self.lenses :
+    alternative = choice_point()
+    start_position = concrete_input_reader.get_pos()
+    for index, lens in enumerate(self.lenses) :
       try :
-        with automatic_rollback(concrete_input_reader, current_container) :
-          return lens.get(concrete_input_reader, current_container)
+        with alternative, automatic_rollback(concrete_input_reader, current_container) :
+          item = lens.get(concrete_input_reader, current_container)
       except LensException:
-        pass
+        # If the lens committed to this alternative (see Commit), we must not
+        # try the others.
+        if alternative.committed :
+          raise
+        continue
+
+      # Record which alternative GOT the input, for the rest of this call, and
+      # the item, so that on PUT we may try that alternative first.
+      get_current_context().caches.setdefault(OR_BRANCHES, {})[(self, concrete_input_reader.document, start_position)] = index
+      if has_value(item) and item_has_meta(item) :
+        if item._meta_data.or_branches == None :
+          item._meta_data.or_branches = {}
+        item._meta_data.or_branches[self] = index
+      return item
         
     raise LensException("We should have GOT one of the lenses.")
 
@@ -852,7 +1265,15 @@ class Or(Lens) :
     # Store the initial state.
     initial_state = get_rollbackables_state(concrete_input_reader, current_container)
 
-    for lens_a in self.lenses:
+    # First try the alternatives that we recorded on GET, which, for an item
+    # PUT back where it came from, saves us the search below.
+    try :
+      with automatic_rollback(concrete_input_reader, current_container, initial_state=initial_state) :
+        return self._put_recorded_branches(item, concrete_input_reader, current_container)
+    except LensException:
+      pass
+
+    for index_a, lens_a in enumerate(self.lenses):
       # Try a straight put on the lens - this will also succeed if there is no
       # input.
       try :
@@ -875,8 +1296,10 @@ class Or(Lens) :
 
       # If the GET suceeded with lens_a, try to PUT with one of the other
       # lenses.
-      for lens_b in self.lenses:
-        if lens_a is lens_b:
+      # Note, we compare positions rather than lenses, since identical
+      # alternatives may be the same (e.g. interned) lens.
+      for index_b, lens_b in enumerate(self.lenses):
+        if index_a == index_b:
           continue
 
         try :
@@ -887,6 +1310,39 @@ class Or(Lens) :
 
     raise LensException("We should have PUT one of the lenses.")
 
+  def _put_recorded_branches(self, item, concrete_input_reader, current_container) :
+    """
+    PUTs the item with the alternative that GOT it, after consuming the input
+    with the alternative that GOT the input (i.e. a straight PUT if these are
+    the same), as recorded by _get() in the item's meta data or earlier in
+    this call.  Raises a LensException if nothing was
+    recorded, leaving the caller to search the alternatives.
+    """
+    item_branch = None
+    if has_value(item) and item_has_meta(item) and item._meta_data.or_branches :
+      item_branch = item._meta_data.or_branches.get(self)
+
+    input_branch = None
+    if concrete_input_reader :
+      branch_key = (self, concrete_input_reader.document, concrete_input_reader.get_pos())
+      input_branch = get_current_context().caches.get(OR_BRANCHES, {}).get(branch_key)
+      # If the item was GOT from here, so was the input by the same alternative.
+      if not has_value(input_branch) and has_value(item_branch) and AbstractContainer._was_got_from(item, concrete_input_reader) :
+        input_branch = item_branch
+      # With no item, we may still straight PUT the alternative that GOT the input.
+      if not has_value(item) :
+        item_branch = input_branch
+
+    if not has_value(item_branch) or (concrete_input_reader and not has_value(input_branch)) :
+      raise LensException("No alternative was recorded for this PUT.")
+
+    d("Trying recorded alternatives: item %s, input %s" % (item_branch, input_branch))
+    if not concrete_input_reader or input_branch == item_branch :
+      return self.lenses[item_branch].put(item, concrete_input_reader, current_container)
+
+    self.lenses[input_branch].get_and_discard(concrete_input_reader, current_container)
+    return self.lenses[item_branch].put(item, None, current_container)
+
 
   def _display_id(self) :
     """For debugging clarity."""
@@ -914,7 +1370,23 @@ class Or(Lens) :
     concrete_input_reader = ConcreteInputReader("abc")
     assert(lens.put(4, concrete_input_reader) == "4")
     assert(concrete_input_reader.get_remaining() == "bc")
-    
+
+    d("Alternatives GETting items and input are recorded for PUT")
+    got = lens.get("4")
+    assert(got._meta_data.or_branches[lens] == 1)
+    context = LensContext()
+    with lens_context(context) :
+      concrete_input_reader = ConcreteInputReader("abc")
+      lens.get(concrete_input_reader)
+      assert(context.caches[OR_BRANCHES] == {(lens, concrete_input_reader.document, 0) : 0})
+      # So a cross PUT within the same call needs no search.
+      concrete_input_reader.reset()
+      assert(lens.put(got, concrete_input_reader) == "4")
+      assert(concrete_input_reader.get_remaining() == "bc")
+    # Whilst an item PUT back where it came from needs no record of the input.
+    concrete_input_reader = ConcreteInputReader("4")
+    assert(lens.put(got, concrete_input_reader) == "4")
+
     d("Test with default values")
     lens = AnyOf(alphas, type=str) | AnyOf(nums, default=3)
     assert(lens.put() == "3")
@@ -1005,6 +1477,27 @@ class AnyOf(Lens) :
     return item
 
 
+  def _get_nullability(self, visiting) :
+    return Lens.NOT_NULLABLE
+
+  @staticmethod
+  def _can_merge(lens_a, lens_b) :
+    """
+    Determines if two alternative AnyOf lenses may be merged into one, which
+    they may only if untyped, since items refer to the (STORE) lens that GOT
+    them, as may containers (e.g. store_items_from_lenses).
+    """
+    for lens in [lens_a, lens_b] :
+      if not (lens.__class__ == AnyOf and not lens.negate and lens._is_plain()) :
+        return False
+    return True
+
+  @staticmethod
+  def _merge(lens_a, lens_b) :
+    """Merges two AnyOf lenses, checked with _can_merge(), into one that matches the chars of either."""
+    valid_chars = lens_a.valid_chars + "".join([char for char in lens_b.valid_chars if char not in lens_a.valid_chars])
+    return AnyOf(valid_chars)
+
   def _is_valid_char(self, char) :
     """Tests if that passed is a valid character for this lens."""
     if self.negate :
@@ -1079,6 +1572,29 @@ class Repeat(Lens) :
     
     self.min_count, self.max_count = min_count, max_count
     self.extend_sublenses([lens])
+    self._analyse_repeated_lens()
+
+  def _analyse_repeated_lens(self) :
+    """
+    Checks the repeated lens consumes input, noting if it always does: if
+    so, we need not check each iteration changed some state, to avoid
+    repeating it for ever.
+    """
+    nullability = self.lenses[0].get_nullability()
+    if nullability == Lens.ALWAYS_EMPTY :
+      raise LensDefinitionException("%s would repeat %s, which consumes no input, for ever." % (self, self.lenses[0]))
+    self._repeated_lens_is_nullable = nullability != Lens.NOT_NULLABLE
+
+  def _validate(self) :
+    super(Repeat, self)._validate()
+    # Since our lens may have changed (e.g. a Forward lens may now be bound).
+    self._analyse_repeated_lens()
+
+  def _get_nullability(self, visiting) :
+    nullability = self.lenses[0].get_nullability(visiting)
+    if nullability == Lens.NOT_NULLABLE and self.min_count == 0 :
+      return Lens.NULLABLE
+    return nullability
 
 
   def _get(self, concrete_input_reader, current_container) :
@@ -1095,17 +1611,39 @@ class Repeat(Lens) :
     # For tracking how many successful GETs
     no_got = 0
 
+    # Some records may already have been GOT in parallel, keyed by position.
+    pre_got_records = get_current_context().caches.get((PRE_GOT_RECORDS, self))
+
+    # Each iteration is an alternative to stopping, which the lens may commit to.
+    iteration = choice_point()
+
     while(True) :
-      # Instantiate the rollback context, so we can later check if any state was changed.
-      rollback_context = automatic_rollback(concrete_input_reader, current_container, check_for_state_change=True)
+      # If we have reached a position from which records were GOT in parallel,
+      # we need only store them.  Otherwise (e.g. if that chunk of input
+      # failed to parse alone) we GET sequentially until we reach such a
+      # position.
+      if pre_got_records and concrete_input_reader.get_pos() in pre_got_records :
+        end_position, items = pre_got_records[concrete_input_reader.get_pos()]
+        if has_value(current_container) :
+          # Note, items may have come from typed sub-lenses of the repeated lens.
+          for item in items :
+            current_container.store_item(item, item._meta_data.lens, concrete_input_reader)
+        concrete_input_reader.set_pos(end_position)
+        no_got += len(items)
+        continue
+
+      start_position = concrete_input_reader.get_pos()
       try :
-        with rollback_context :
+        with iteration, automatic_rollback(concrete_input_reader, current_container) :
           self.container_get(lens, concrete_input_reader, current_container)
         
-        # If the lens changed no state, then we must break, otherwise continue
-        # for ever.
-        if not rollback_context.some_state_changed :
-          d("Lens %s changed no state during this iteration, so we must break out - or spin for ever" % lens)
+        # If our lens may consume no input and did not, then we must break,
+        # since each further iteration would do just the same - for ever.
+        # Note, we keep any item it stored, though do not count it.  We cannot
+        # simply check if the container changed, since storing an item (e.g.
+        # an empty list) is itself a change.
+        if self._repeated_lens_is_nullable and concrete_input_reader.get_pos() == start_position :
+          d("Lens %s consumed no input during this iteration, so we must break out - or spin for ever" % lens)
           break
         
         no_got += 1
@@ -1114,6 +1652,8 @@ class Repeat(Lens) :
         if has_value(self.max_count) and no_got == self.max_count :
           break
       except LensException :
+        if iteration.committed :
+          raise
         break
 
     if no_got < self.min_count :
@@ -1153,10 +1693,14 @@ class Repeat(Lens) :
       # Allows the while loop to request breakout from outer for loop.
       break_for_loop = False
 
+      # When CREATING, our lens may change no state even if it always consumes
+      # input when there is some.
+      check_for_state_change = self._repeated_lens_is_nullable or not has_value(input_reader)
+
       while True :
         # Call PUT on the lens and break this while loop if no state changed or we
         # get a LensException.  Also, break the for loop if we PUT max count.
-        rollback_context = automatic_rollback(input_reader, current_container, check_for_state_change=True)
+        rollback_context = automatic_rollback(input_reader, current_container, check_for_state_change=check_for_state_change)
         try :
           with rollback_context:
             put = self.container_put(lens, input_reader, current_container)
@@ -1165,7 +1709,7 @@ class Repeat(Lens) :
           # Infact we should not expect a LensException - only break out when no state changes.
           break
 
-        if not rollback_context.some_state_changed :
+        if check_for_state_change and not rollback_context.some_state_changed :
           d("Lens %s changed no state during this iteration, so we must break out - or spin for ever" % lens)
           break
 
@@ -1201,7 +1745,7 @@ class Repeat(Lens) :
       # possible.
       while(True) :
         # Instantiate the rollback context, so we can later check if any state was changed.
-        rollback_context = automatic_rollback(concrete_input_reader, current_container, check_for_state_change=True)
+        rollback_context = automatic_rollback(concrete_input_reader, current_container, check_for_state_change=self._repeated_lens_is_nullable)
         try :
           with rollback_context :
             # XXX: Inefficient to discard container items each time.
@@ -1209,7 +1753,7 @@ class Repeat(Lens) :
           
           # If the lens changed no state, then we must break, otherwise continue
           # for ever.
-          if not rollback_context.some_state_changed :
+          if self._repeated_lens_is_nullable and not rollback_context.some_state_changed :
             d("Lens %s changed no state during this iteration, so we must break out - or spin for ever" % lens)
             break
           
@@ -1311,8 +1855,14 @@ class Repeat(Lens) :
     GlobalSettings.check_consumption = True
 
     d("Test infinity problem")
-    lens = Repeat(Empty(), min_count=3, max_count=None)
-    # Will fail to get anything since Empty lens changes no state.
+    # A lens that never consumes input cannot be repeated.
+    with assert_raises(LensDefinitionException) :
+      Repeat(Empty(), min_count=3, max_count=None)
+    
+    # But one that may not is checked as we go.
+    lens = Repeat(AnyOf(nums) | Empty(), min_count=3, max_count=None)
+    assert(lens._repeated_lens_is_nullable)
+    # Will fail to get anything since the lens changes no state.
     with assert_raises(LensException) :
       lens.get("anything")
     # Likewise.
@@ -1341,6 +1891,9 @@ class Empty(Lens) :
     self.default = ""
     self.mode = mode
 
+  def _get_nullability(self, visiting) :
+    return Lens.ALWAYS_EMPTY
+
 
   def _get(self, concrete_input_reader, current_container) :
     
@@ -1436,6 +1989,9 @@ class Group(Lens) :
   def _put(self, item, concrete_input_reader, current_container) :
     return self.lenses[0].put(item, concrete_input_reader, current_container)
 
+  def _get_nullability(self, visiting) :
+    return self.lenses[0].get_nullability(visiting)
+
   @staticmethod
   def TESTS() :
     GlobalSettings.check_consumption = False
@@ -1517,6 +2073,14 @@ class Literal(Lens) :
     return item
 
 
+  def _get_nullability(self, visiting) :
+    return Lens.NOT_NULLABLE
+
+  @staticmethod
+  def _is_plain_literal(lens) :
+    """Determines if a lens is a Literal with no type or settings, so may be merged with others."""
+    return lens.__class__ == Literal and lens._is_plain(implicit_default=lens.literal_string)
+
   def _display_id(self) :
     """To aid debugging."""
     # Name is only set after Lens constructor called.
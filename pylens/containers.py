@@ -50,6 +50,18 @@ LABEL = "LABEL"
 # Just used to simplify sorting.
 LARGE_INTEGER = 0xffffffff
 
+# Marks the slot of an item removed from a container during PUT.
+REMOVED_ITEM = "REMOVED_ITEM"
+
+# Marks, in a LensObject's undo log, an attribute that was not set.
+UNSET_ATTRIBUTE = "UNSET_ATTRIBUTE"
+
+# Used in mapping labels to and from python identifiers.
+IDENTIFIER_REGEX = re.compile(r"[a-zA-Z][a-zA-Z0-9_]*$")
+SPACES_REGEX = re.compile(r"[ ]+")
+# The most label to identifier conversions a LensObject class will memoise.
+MAX_CACHED_LABELS = 1000
+
 
 class AbstractContainer(Rollbackable) :
   """
@@ -66,6 +78,9 @@ class AbstractContainer(Rollbackable) :
   to an item; with a general class, however, this may not be the case.
   """
 
+  # Allows slotted subclasses (see slotted_lens_object).
+  __slots__ = ()
+
   def __new__(cls, *args, **kargs) :
     self = super(AbstractContainer, cls).__new__(cls, *args, **kargs)
     # Initialise some vars regardless of __init__ being called.
@@ -126,14 +141,19 @@ class AbstractContainer(Rollbackable) :
       self._label = None
       return output
 
-    # Get candidates to PUT
-    candidates = self.get_put_candidates(lens, concrete_input_reader)
+    # A lens with a static label may PUT only items with that label, which a
+    # container may be able to look up directly.
+    if has_value(lens.options.label) :
+      candidates = self.get_put_candidates_with_label(lens, lens.options.label, concrete_input_reader)
+    else :
+      # Get candidates to PUT
+      candidates = self.get_put_candidates(lens, concrete_input_reader)
 
-    d("Unfiltered candidates: %s" % candidates)
-    
-    # Filter and sort them appropriately for our context (e.g. the lens, the
-    # alignment mode and the current input postion.
-    candidates = self.filter_and_sort_candidate_items(candidates, lens, concrete_input_reader)
+      d("Unfiltered candidates: %s" % candidates)
+      
+      # Filter and sort them appropriately for our context (e.g. the lens, the
+      # alignment mode and the current input postion.
+      candidates = self.filter_and_sort_candidate_items(candidates, lens, concrete_input_reader)
     
     d("Filtered candidates: %s" % candidates)
 
@@ -151,6 +171,22 @@ class AbstractContainer(Rollbackable) :
     raise NoTokenToConsumeException()
 
 
+  def get_put_candidates_with_label(self, lens, label, concrete_input_reader) :
+    """
+    Returns the candidate items with the given static label, in the order
+    they should be tried.  Containers may overload this to avoid considering
+    every item.
+    """
+    candidates = self.get_put_candidates(lens, concrete_input_reader)
+    return self.filter_and_sort_candidate_items(candidates, lens, concrete_input_reader)
+
+  @staticmethod
+  def _has_static_label(item, label) :
+    """Checks if an item may be PUT by a lens with the given static label."""
+    # XXX: Feels a bit of a hack to use attr_label, so will think more
+    # generally about this.
+    return label in [item._meta_data.label, item._meta_data.attr_label]
+
   def filter_and_sort_candidate_items(self, candidate_items, lens, concrete_input_reader) :
     """
     In some cases we can whittle down the candidate list based on properties
@@ -164,36 +200,106 @@ class AbstractContainer(Rollbackable) :
     # a static label.
     if has_value(lens.options.label) :
       d("Using static label: '%s'" % lens.options.label)
-      # XXX: Feels a bit of a hack to use attr_label, so will think more
-      # generally about this.
-      valid_candidates = [item for item in candidate_items if lens.options.label in [item._meta_data.label, item._meta_data.attr_label]]
+      valid_candidates = [item for item in candidate_items if self._has_static_label(item, lens.options.label)]
       return valid_candidates
 
     # Handle MODEL alignment (i.e. PUT will be in order of items in the abstract
     # model).
     if self._alignment_mode == MODEL :
       # By definition, items are already in that order.
-      if len(candidate_items) > 0:
-        return [candidate_items[0]]
-      else:
-        return [] 
+      return self._get_first_candidate(candidate_items)
     
     # Handle SOURCE alignment.
     if self._alignment_mode == SOURCE :
-      # Copy candidate_items.
-      def get_key(item) :
-        if has_value(item._meta_data.concrete_start_position) :
-          return item._meta_data.concrete_start_position
-        return LARGE_INTEGER # To ensure new items go on the end.
-      
-      # Sort the candiates by their source order - if they have meta on their
-      # source position.
-      sorted_candidate_items = sorted(candidate_items, key = get_key)
-      return sorted_candidate_items
-    # TODO: LABEL alignment mode
+      return self._get_source_ordered_candidates(candidate_items, lens)
+
+    # Handle LABEL alignment (i.e. PUT will be of the item with the label of
+    # that in the input).
+    if self._alignment_mode == LABEL :
+      return self._get_label_aligned_candidates(candidate_items, lens, concrete_input_reader)
     
     raise Exception("Unknown alignment mode: %s" % self._alignment_mode)
 
+  #
+  # SOURCE alignment
+  #
+
+  @staticmethod
+  def _get_source_order_key(item) :
+    if has_value(item._meta_data.concrete_start_position) :
+      return item._meta_data.concrete_start_position
+    return LARGE_INTEGER # To ensure new items go on the end.
+
+  def _get_source_ordered_candidates(self, candidate_items, lens) :
+    """
+    Returns the candidates in their source order - if they have meta on their
+    source position.  Containers that hold their candidates may overload this
+    to avoid sorting them for every item that is PUT.
+    """
+    # Note, the sort is stable, so new items keep their model order.
+    return sorted(candidate_items, key = self._get_source_order_key)
+
+  #
+  # LABEL alignment
+  #
+
+  def _get_label_aligned_candidates(self, candidate_items, lens, concrete_input_reader) :
+    """
+    Returns the item GOT from the current input position, if there is one, or
+    else the item with the same label as that in the input, so that items
+    may be PUT back in place even if they were changed or re-ordered in the
+    model.  Otherwise (e.g. if the item in the input was removed from the
+    model, or when CREATING) items are PUT in model order, as in MODEL mode.
+    """
+    if has_value(concrete_input_reader) :
+      candidates = self._find_candidates_at_position(candidate_items, concrete_input_reader)
+      if candidates :
+        return candidates
+      
+      label = self._get_label_at_position(lens, concrete_input_reader)
+      if has_value(label) :
+        candidates = self._find_candidates_with_label(candidate_items, label)
+        if candidates :
+          return candidates
+
+    return self._get_first_candidate(candidate_items)
+
+  @staticmethod
+  def _get_first_candidate(candidate_items) :
+    """Returns a list of just the first candidate, if any."""
+    # Note, candidate_items may be any iterable.
+    for item in candidate_items :
+      return [item]
+    return []
+
+  def _get_label_at_position(self, lens, concrete_input_reader) :
+    """
+    Returns the label of the item the lens would GET from the input, without
+    consuming it.  Note, this costs a full GET of the item, so is done only
+    where no candidate was GOT from this position.
+    """
+    start_state = get_rollbackables_state(concrete_input_reader)
+    try :
+      item = lens.get(concrete_input_reader)
+    except LensException :
+      return None
+    finally :
+      set_rollbackables_state(start_state, concrete_input_reader)
+    return item._meta_data.label
+
+  def _find_candidates_at_position(self, candidate_items, concrete_input_reader) :
+    """Returns those items that were GOT from the current position of the input."""
+    return [item for item in candidate_items if self._was_got_from(item, concrete_input_reader)]
+
+  def _find_candidates_with_label(self, candidate_items, label) :
+    return [item for item in candidate_items if item._meta_data.label == label]
+
+  @staticmethod
+  def _was_got_from(item, concrete_input_reader) :
+    """Checks if an item was GOT from the current position of the input."""
+    meta_data = item._meta_data
+    return has_value(meta_data.concrete_document) and concrete_input_reader.is_at(meta_data.concrete_document, meta_data.concrete_start_position)
+
 
   #
   # Must overload these.
@@ -235,49 +341,223 @@ class ListContainer(AbstractContainer) :
   def __new__(cls, *args, **kargs) :
     self = super(ListContainer, cls).__new__(cls, *args, **kargs)
     self.container_item = []
+    # During PUT, rather than shuffle the list, a removed item is replaced by
+    # a marker, so removal is by identity and items keep their slots in the
+    # list, which the indexes below refer to.
+    self._no_removed = 0
+    # The first slot that may hold an item not yet removed.
+    self._head = 0
+    # Maps item ids to their slots, when first needed (see remove_item).
+    self._slot_index = None
+    # Maps labels to slots, in order, when first needed (see
+    # get_put_candidates_with_label).
+    self._label_index = None
+    # Likewise, maps the input positions items were GOT from to slots, for
+    # LABEL alignment.
+    self._position_index = None
+    # For SOURCE alignment, our slots sorted once into source order, the rank
+    # of each slot in that order, and the rank of the first that may remain.
+    self._source_order = None
+    self._source_ranks = None
+    self._source_head = 0
+    # Our stores and removals, so that rollback need only undo those made
+    # since the state was taken.
+    self._undo_log = []
     return self
   
   def __init__(self, container_item) :
     assert isinstance(container_item, list)
-    self.container_item = container_item
   
-    assert_msg(isinstance(self.container_item, list))
-
     # Ensure our items can carry meta data (for algorithmic convenience) and be careful
     # to preserve the incoming lists meta data by modifying it in place.
     # Perhaps this can be done in AbstractContainer
-    for index, item in enumerate(self.container_item) :
-      self.container_item[index] = enable_meta_data(item)
+    for index, item in enumerate(container_item) :
+      container_item[index] = enable_meta_data(item)
+
+    # We consume a copy of the list, so the incoming list is left intact by PUT.
+    self.container_item = list(container_item)
     
       
   def get_put_candidates(self, lens, concrete_input_reader) :
-    return self.container_item
+    return RemainingItems(self)
   
+  def get_put_candidates_with_label(self, lens, label, concrete_input_reader) :
+    if self._label_index == None :
+      self._label_index = {}
+      for slot in self._get_slots() :
+        self._index_slot_labels(slot)
+    return self._get_items_in_slots(self._label_index.get(label, []))
+
   def remove_item(self, lens, item) :
     #d("Removing item %s" % item)
-    self.container_item.remove(item)
+    slot = self._find_slot(item)
+    self.container_item[slot] = REMOVED_ITEM
+    self._no_removed += 1
+    self._undo_log.append((REMOVED_ITEM, slot, item))
 
   def store_item(self, item, lens, concrete_input_reader) :
+    slot = len(self.container_item)
     self.container_item.append(item)
+    if self._slot_index != None :
+      self._slot_index.setdefault(id(item), []).append(slot)
+    if self._label_index != None :
+      self._index_slot_labels(slot)
+    if self._position_index != None :
+      self._index_slot_position(slot)
+    # The source order must be rebuilt to include the new item.
+    self._source_order = None
+    self._undo_log.append((None, slot, item))
+
+  def _find_slot(self, item) :
+    """Finds the slot of the (exact) item, which must not have been removed."""
+    if self._slot_index == None :
+      self._slot_index = {}
+      for slot in self._get_slots() :
+        self._slot_index.setdefault(id(self.container_item[slot]), []).append(slot)
+    # Note, the same item may be in the list more than once.
+    for slot in self._slot_index.get(id(item), []) :
+      if self.container_item[slot] is item :
+        return slot
+    raise Exception("Failed to remove item %s from %s." % (item, self))
+
+  def _get_slots(self) :
+    """Returns the slots of the items not yet removed."""
+    return [slot for slot, item in enumerate(self.container_item) if item is not REMOVED_ITEM]
+
+  def _get_items_in_slots(self, slots) :
+    """Returns the items, not yet removed, in the given slots."""
+    return [self.container_item[slot] for slot in slots if self.container_item[slot] is not REMOVED_ITEM]
+
+  def _iterate_remaining_items(self) :
+    """Yields the items not yet removed, in model order, advancing past those removed."""
+    index = self._head
+    while index < len(self.container_item) :
+      item = self.container_item[index]
+      if item is not REMOVED_ITEM :
+        yield item
+      elif index == self._head :
+        self._head += 1
+      index += 1
+
+  def _get_source_ordered_candidates(self, candidate_items, lens) :
+    # If some other collection of candidates, just sort it.
+    if not (isinstance(candidate_items, RemainingItems) and candidate_items.container is self) :
+      return super(ListContainer, self)._get_source_ordered_candidates(candidate_items, lens)
+
+    # Sort our items only once, then skip over those since removed.
+    if self._source_order == None :
+      get_key = lambda slot : self._get_source_order_key(self.container_item[slot])
+      self._source_order = sorted(self._get_slots(), key = get_key)
+      self._source_ranks = dict([(slot, rank) for rank, slot in enumerate(self._source_order)])
+      self._source_head = 0
+    return self._iterate_source_order()
+
+  def _iterate_source_order(self) :
+    """Yields the items not yet removed in source order, advancing past those removed."""
+    source_order = self._source_order
+    rank = self._source_head
+    while rank < len(source_order) :
+      item = self.container_item[source_order[rank]]
+      if item is not REMOVED_ITEM :
+        yield item
+      elif rank == self._source_head :
+        self._source_head += 1
+      rank += 1
+
+  def _find_candidates_at_position(self, candidate_items, concrete_input_reader) :
+    # Note, candidate_items are simply our items.
+    if self._position_index == None :
+      self._position_index = {}
+      for slot in self._get_slots() :
+        self._index_slot_position(slot)
+    items = self._get_items_in_slots(self._position_index.get(concrete_input_reader.get_pos(), []))
+    return [item for item in items if self._was_got_from(item, concrete_input_reader)]
+
+  def _find_candidates_with_label(self, candidate_items, label) :
+    # Note, the label index also holds items by attr_label.
+    items = self.get_put_candidates_with_label(None, label, None)
+    return [item for item in items if item._meta_data.label == label]
+
+  def _get_item_labels(self, item) :
+    """Returns the labels by which an item is indexed."""
+    return set([label for label in [item._meta_data.label, item._meta_data.attr_label] if has_value(label)])
+
+  def _index_slot_labels(self, slot) :
+    for label in self._get_item_labels(self.container_item[slot]) :
+      self._label_index.setdefault(label, []).append(slot)
+
+  def _index_slot_position(self, slot) :
+    start_position = self.container_item[slot]._meta_data.concrete_start_position
+    if has_value(start_position) :
+      self._position_index.setdefault(start_position, []).append(slot)
+
+  def _undo(self, entry) :
+    """Undoes a store or removal from the log."""
+    action, slot, item = entry
+    if action == REMOVED_ITEM :
+      self.container_item[slot] = item
+      self._no_removed -= 1
+      self._head = min(self._head, slot)
+      if self._source_order != None :
+        self._source_head = min(self._source_head, self._source_ranks[slot])
+      return
+
+    # Otherwise, undo the store of the last item, which will also be the last
+    # slot in any index.
+    self.container_item.pop()
+    if self._slot_index != None :
+      self._slot_index[id(item)].pop()
+    if self._label_index != None :
+      for label in self._get_item_labels(item) :
+        self._label_index[label].pop()
+    if self._position_index != None and has_value(item._meta_data.concrete_start_position) :
+      self._position_index[item._meta_data.concrete_start_position].pop()
 
   
   def unwrap(self):
+    if self._no_removed :
+      return [item for item in self.container_item if item is not REMOVED_ITEM]
     return self.container_item
 
   def _get_state(self, copy_state=True) :
-    state = [copy_state and copy.copy(self.container_item) or self.container_item, self._label]
+    # Since we only ever add or remove items, our state is simply how far
+    # through our log of those changes we are.
+    state = [len(self._undo_log), self._label]
     return state
 
+  def _forget_earlier_states(self) :
+    self._undo_log = []
+
   def _set_state(self, state, copy_state=True) :
-    self.container_item = copy_state and copy.copy(state[0]) or state[0]
-    self._label = state[1]
+    log_position, self._label = state
+    assert_msg(log_position <= len(self._undo_log), "Cannot roll %s forwards to a later state." % self)
+    while len(self._undo_log) > log_position :
+      self._undo(self._undo_log.pop())
 
   def __str__(self) :
-    return str(self.container_item)
+    return str(self.unwrap())
   __repr__ = __str__
   
   def is_fully_consumed(self) :
-    return len(self.container_item) == 0
+    return len(self.container_item) == self._no_removed
+
+
+class RemainingItems(object) :
+  """
+  A view of the items of a ListContainer that have not yet been PUT, which
+  may be iterated many times without copying the items.
+  """
+
+  def __init__(self, container) :
+    self.container = container
+
+  def __iter__(self) :
+    return self.container._iterate_remaining_items()
+
+  def __str__(self) :
+    # Note, this is formatted for debugging on every PUT, so is kept brief.
+    return "<%s remaining items>" % (len(self.container.container_item) - self.container._no_removed)
+  __repr__ = __str__
 
 
 class DictContainer(ListContainer) :
@@ -364,9 +644,8 @@ class LensObject(AbstractContainer) :
   can be used to store specific items.
   """
 
-  # Used to help with re-generating labels from object attribute names.  The
-  # class seems a good a place as any to store this globally-useful data.
-  __cached_labels = {}
+  # Holds our log of attribute changes outside of __dict__ (see _get_state).
+  __slots__ = ["_undo_log"]
 
   
   def __new__(cls, *args, **kargs) :
@@ -400,7 +679,12 @@ class LensObject(AbstractContainer) :
     if not has_value(item._meta_data.label) :
       raise LensException("%s expected item %s to have a label." % (self, item))
     # TODO: If constrained attributes, check within set.
-    setattr(self, self.map_label_to_identifier(item._meta_data.label), item)
+    identifier = self.map_label_to_identifier(item._meta_data.label)
+    try :
+      setattr(self, identifier, item)
+    except AttributeError :
+      # e.g. A slotted class may have no such attribute.
+      raise LensException("%s could not store item %s as attribute '%s'." % (self, item, identifier))
 
   
   def unwrap(self):
@@ -410,6 +694,8 @@ class LensObject(AbstractContainer) :
     for name, container in self._containers.iteritems() :
       setattr(self, name, container.unwrap())
 
+    # Our GET is complete, so there is no longer any state to roll back to.
+    self._forget_earlier_states()
     return self
  
   #
@@ -420,9 +706,16 @@ class LensObject(AbstractContainer) :
     # TODO: Shall we call on sub containers - perhaps not, since can set alignment from props
     super(LensObject, self).set_container_lens(lens)
     # For a general class container, SOURCE alignment will be a more common default.
-    # Maybe LABEL mode would be more suitable when I implement it.
+    # Maybe LABEL mode would be more suitable.
     self._alignment_mode = self._container_lens.options.alignment or SOURCE
  
+  def _get_source_ordered_candidates(self, candidate_items, lens) :
+    # Let a sub container order the candidates that it holds.
+    sub_container = self._get_item_sub_container(lens)
+    if sub_container :
+      return sub_container._get_source_ordered_candidates(candidate_items, lens)
+    return super(LensObject, self)._get_source_ordered_candidates(candidate_items, lens)
+
 
   def get_put_candidates(self, lens, concrete_input_reader) :
     # First see if the item is to be put from one of our containers.
@@ -432,22 +725,46 @@ class LensObject(AbstractContainer) :
       return sub_container.get_put_candidates(lens, concrete_input_reader)
 
     # Now try to find our own candidates.
-    d("Looking for own canidates. %s" % self.__dict__)
+    d("Looking for own canidates. %s" % self._iterate_instance_attributes())
     candidates = []
 
-    # Append all of our data attributes that are not None.
+    # Append all of our data attributes that are not None (or not set).
     for attr_name in self._get_attribute_names() :
-      # Skip if the item has not been set.
-      if attr_name not in self.__dict__ :
-        continue
-
-      item = self.__dict__[attr_name]
+      item = self._get_instance_attribute(attr_name)
       if has_value(item) :
         candidates.append(item)
     
     return candidates
 
  
+  def get_put_candidates_with_label(self, lens, label, concrete_input_reader) :
+    # First see if the item is to be put from one of our containers.
+    sub_container = self._get_item_sub_container(lens)
+    if sub_container :
+      return sub_container.get_put_candidates_with_label(lens, label, concrete_input_reader)
+
+    # Rather than consider every attribute, look first at those the label may
+    # have been stored in: the label as an identifier, or as the attribute name.
+    try :
+      attr_names = [self.map_label_to_identifier(label), label]
+    except Exception :
+      # The label cannot be an identifier here, but the item may still have
+      # been stored under some other attribute.
+      attr_names = [label]
+    candidates = []
+    for attr_name in attr_names :
+      if self._is_attribute_name(attr_name) :
+        item = self._get_instance_attribute(attr_name)
+        if has_value(item) and self._has_static_label(item, label) and not [candidate for candidate in candidates if candidate is item] :
+          candidates.append(item)
+    
+    # Otherwise, fall back to considering every attribute.
+    if not candidates :
+      d("No attribute found for label '%s', so considering all attributes." % label)
+      candidates = super(LensObject, self).get_put_candidates_with_label(lens, label, concrete_input_reader)
+
+    return candidates
+
   def remove_item(self, lens, item) :
     # First see if the item is to be put from one of our containers.
     sub_container = self._get_item_sub_container(lens, item)
@@ -457,9 +774,15 @@ class LensObject(AbstractContainer) :
       return
     
     d("Preparing to remove %s" % item)
-    for attr_name, value in self.__dict__.iteritems() :
+    # Items are usually still in the attributes they were prepared in.
+    attr_name = item._meta_data.container_attribute
+    if has_value(attr_name) and self._get_instance_attribute(attr_name) is item :
+      self._delete_attribute(attr_name)
+      return
+
+    for attr_name, value in self._iterate_instance_attributes() :
       if value is item :
-        del self.__dict__[attr_name]
+        self._delete_attribute(attr_name)
         return
 
     raise Exception("Failed to remove item %s from %s."% (item, self))
@@ -483,7 +806,7 @@ class LensObject(AbstractContainer) :
   def is_fully_consumed(self) :
     # Check if our items are consumed.
     for attribute_name in self._get_attribute_names() :
-      if attribute_name in self.__dict__ and has_value(self.__dict__[attribute_name]) :
+      if has_value(self._get_instance_attribute(attribute_name)) :
         return False
 
     # Then, check if at least one of our containers is not fully consumed.
@@ -502,32 +825,47 @@ class LensObject(AbstractContainer) :
     Tries to convert a typical label to a python identifier.  You may wish to
     overload this if you require more specialised conversion.
     """
+    # Labels tend to recur, so we remember their conversions for this class.
+    identifiers = self._get_class_cache("_cached_identifiers", lambda : BoundedDict(MAX_CACHED_LABELS))
+    # Note, other threads may evict the label at any time, so we look it up
+    # just once.
+    identifier = identifiers.get(label)
+    if has_value(identifier) :
+      return identifier
+
     identifier = self._map_label_to_identifier(label)
 
     # Check we end up with a valid python keyword.
-    if not re.match(r"[a-zA-Z][a-zA-Z0-9_]*$", identifier) :
+    if not IDENTIFIER_REGEX.match(identifier) :
       raise Exception("Cannot express label '%s' (converted to '%s') as a python identifer to set as an object attribute - you will have to specialise this functionality for your purposes." % (label, identifier)) 
    
-    # Cache this conversion on the class, since it may be useful to improve
-    # CREATED labels.
-    self.__class__.__cached_labels[identifier] = label
+    # Cache this conversion on the class, since it may also be useful to
+    # improve CREATED labels.
+    identifiers[label] = identifier
+    self._get_cached_labels()[identifier] = label
 
     return identifier
   
   def map_identifier_to_label(self, identifier) :
-    if identifier in self.__class__.__cached_labels :
-      return self.__class__.__cached_labels[identifier]
+    cached_labels = self._get_cached_labels()
+    if identifier in cached_labels :
+      return cached_labels[identifier]
 
     # We assume that an underscore represents a space.
     return self._map_identifier_to_label(identifier)
 
+  def _get_cached_labels(self) :
+    """Returns the labels that identifiers of this class were converted from."""
+    # Note, unlike the conversions to identifiers, which are merely memoised,
+    # we must remember every label, to restore it when CREATING the attribute.
+    return self._get_class_cache("_cached_labels", dict)
+
   # He he: Really we should use a lens for these mappings, but perhaps it's
   # easy enough to do it like this.
   def _map_label_to_identifier(self, label) :
     """ This might be overridded to specialise this functionality for a specific.  """
     identifier = label.lower()
-    # XXX: We could pre-compile this regex.
-    identifier = re.sub(r"[ ]+", "_", identifier)
+    identifier = SPACES_REGEX.sub("_", identifier)
     return identifier
   
   def _map_identifier_to_label(self, identifier) :
@@ -538,22 +876,50 @@ class LensObject(AbstractContainer) :
   # Other internal functions.
   #
 
+  @classmethod
+  def _get_class_cache(cls, name, create) :
+    """
+    Returns some data cached in the class' own __dict__ (so not inherited by
+    subclasses, which may be declared differently), creating it if necessary.
+    """
+    if name not in cls.__dict__ :
+      setattr(cls, name, create())
+    return cls.__dict__[name]
+
   def _create_containers_and_attributes(self) :
     """Create any sub-containers, if declared."""
+    container_declarations, constrained_attributes, attribute_order = self._get_class_cache("_declarations", self._get_declarations)
     self._containers = {}
-    self._constrained_attributes = {}
-    for key, value in self.__class__.__dict__.iteritems() :
+    for key, container_properties in container_declarations :
+      self._containers[key] = ContainerFactory.create_container(container_properties.type)
+    # Note, these are shared by all instances of the class.
+    self._constrained_attributes = constrained_attributes
+    
+  @classmethod
+  def _get_declarations(cls) :
+    """
+    Returns the container declarations of the class, its constrained
+    attributes and their declaration order.
+    """
+    container_declarations = []
+    constrained_attributes = {}
+    for key, value in cls.__dict__.iteritems() :
       # Handle containers.
       if isinstance(value, Container) :
         container_properties = value
         assert_msg(has_value(container_properties.type), "You must declare a type for the container definition '%s'." % key)
-        container = ContainerFactory.create_container(container_properties.type)
-        assert_msg(has_value(container), "Could not create an appropriate container for '%s'." % key)
-        self._containers[key] = container
+        assert_msg(has_value(ContainerFactory.get_container_class(container_properties.type)), "Could not create an appropriate container for '%s'." % key)
+        container_declarations.append((key, container_properties))
 
       # Handle explicit attributes, which will constainer those accepted and define CREATE order.
       elif isinstance(value, Attribute) :
-        self._constrained_attributes[key] = value
+        constrained_attributes[key] = value
+
+    # Sort the attributes according to their declaration order - captured by a
+    # static counter in Attribute
+    items = sorted(constrained_attributes.iteritems(), key=lambda x: x[1]._counter)
+    attribute_order = [item[0] for item in items]
+    return container_declarations, constrained_attributes, attribute_order
 
 
   def _get_item_sub_container(self, lens, item=None) :
@@ -565,19 +931,44 @@ class LensObject(AbstractContainer) :
     #  d(item)
     #  assert(item._meta_data.lens)
 
-    for name, container in self._containers.iteritems() :
-      container_properties = self.__class__.__dict__[name]
-      d("looking for item to match lens %s" % lens)
-      if has_value(container_properties.store_items_from_lenses) and lens in container_properties.store_items_from_lenses :
-        return container
-      elif has_value(item) and has_value(container_properties.store_items_from_lenses) and has_value(item._meta_data.lens) and item._meta_data.lens in container_properties.store_items_from_lenses :
-        return container
-      elif has_value(container_properties.store_items_of_type) and type(item) in container_properties.store_items_of_type :
-        return container
-      elif lens.has_type() and lens.type in container_properties.store_items_of_type :
-        return container
+    lens_table, type_table = self._get_sub_container_tables()
+
+    # Find the first of our containers (in the order they would otherwise be
+    # checked) that accepts the lens or item.
+    matches = [lens_table.get(id(lens)), type_table.get(type(item))]
+    if has_value(item) and has_value(item._meta_data.lens) :
+      matches.append(lens_table.get(id(item._meta_data.lens)))
+    if lens.has_type() :
+      matches.append(type_table.get(lens.type))
+    matches = [match for match in matches if has_value(match)]
+    if not matches :
+      return None
+    
+    order, name = min(matches)
+    return self._containers[name]
 
-    return None
+  def _get_sub_container_tables(self) :
+    """
+    Returns tables mapping lens ids and types to the (order, name) of the first
+    of our containers that would store them.  These are built once per class and
+    cached in the class' own __dict__, since subclasses may declare other
+    containers.
+    """
+    return self._get_class_cache("_sub_container_tables", self._build_sub_container_tables)
+
+  def _build_sub_container_tables(self) :
+    container_declarations, constrained_attributes, attribute_order = self._get_class_cache("_declarations", self._get_declarations)
+    container_declarations = dict(container_declarations)
+    lens_table, type_table = {}, {}
+    for order, name in enumerate(self._containers.keys()) :
+      container_properties = container_declarations[name]
+      # Note, setdefault ensures an earlier container takes precedence.
+      for lens in container_properties.store_items_from_lenses or [] :
+        lens_table.setdefault(id(lens), (order, name))
+      for item_type in container_properties.store_items_of_type or [] :
+        type_table.setdefault(item_type, (order, name))
+
+    return lens_table, type_table
 
 
   def _set_excluded_attributes(self) :
@@ -592,7 +983,7 @@ class LensObject(AbstractContainer) :
     Note that any attribute that starts with an underscore will be excluded, so
     this aims to exclude any other attributes, such as sub-container attributes.
     """
-    self._excluded_attributes = self.__dict__.keys() + self._containers.keys()
+    self._excluded_attributes = [name for name, value in self._iterate_instance_attributes()] + self._containers.keys()
 
 
   def _get_attribute_names(self) :
@@ -600,27 +991,34 @@ class LensObject(AbstractContainer) :
     
     # If the useable attributes have been declared, use their names here, in declaration order.
     if self._constrained_attributes :
-      # Sort the items according to their declaration order - captured by a static counter in Attribute
-      items = sorted(self._constrained_attributes.iteritems(), key=lambda x: x[1]._counter)
-      attributes = [item[0] for item in items]
-      return attributes
+      container_declarations, constrained_attributes, attribute_order = self._get_class_cache("_declarations", self._get_declarations)
+      return attribute_order
 
     # Otherwise, use every object attribute that is not excluded.
     attributes = []
-    for attr_name in self.__dict__.keys() :
+    for attr_name, value in self._iterate_instance_attributes() :
       if attr_name not in self._excluded_attributes and not attr_name.startswith("_"):
         attributes.append(attr_name)
     
     return attributes
 
+  def _is_attribute_name(self, attr_name) :
+    """Determines if the named attribute is used to hold a data item (see _get_attribute_names())."""
+    if self._constrained_attributes :
+      return attr_name in self._constrained_attributes
+    return attr_name not in self._excluded_attributes and not attr_name.startswith("_")
+
   def _enable_attributes_meta(self) :
     """Enables meta on attributes that may be used as container state."""
     for attr_name in self._get_attribute_names() :
-      if attr_name not in self.__dict__ :
+      item = self._get_instance_attribute(attr_name, UNSET_ATTRIBUTE)
+      if item is UNSET_ATTRIBUTE :
         continue
 
-      item = enable_meta_data(self.__dict__[attr_name])
-      self.__dict__[attr_name] = item
+      item = enable_meta_data(item)
+      self._set_attribute(attr_name, item)
+      # Note the attribute of the item, so it may be removed directly.
+      item._meta_data.container_attribute = attr_name
       # Ensure the label of the item is updated to match the current attribute
       # name.  If our label has changed, we need to regenerate a label.
       current_label = item._meta_data.label
@@ -630,9 +1028,77 @@ class LensObject(AbstractContainer) :
         # being changed incorrectly in the same way as a dynamic label
         item._meta_data.attr_label = attr_name
 
+  #
+  # Rollback, for which we log changes to our attributes, so that our state
+  # is just a position in that log, rather than a copy of our attributes.
+  #
+
+  def __setattr__(self, name, value) :
+    self._log_attribute_change(name)
+    super(LensObject, self).__setattr__(name, value)
+
+  def __delattr__(self, name) :
+    self._log_attribute_change(name)
+    super(LensObject, self).__delattr__(name)
+
+  #
+  # Direct access to our instance attributes, as held in __dict__, which
+  # slotted classes overload (see slotted_lens_object).
+  #
+
+  def _get_instance_attribute(self, name, default=None) :
+    """Gets an instance attribute (i.e. not falling back on a class attribute)."""
+    return self.__dict__.get(name, default)
+
+  def _iterate_instance_attributes(self) :
+    """Returns the (name, value) of our instance attributes, in a list."""
+    return self.__dict__.items()
+
+  def _set_attribute(self, name, value) :
+    """Sets an instance attribute directly, as if in __dict__."""
+    self._log_attribute_change(name)
+    self.__dict__[name] = value
+
+  def _delete_attribute(self, name) :
+    """Deletes an instance attribute directly, as if from __dict__."""
+    self._log_attribute_change(name)
+    del self.__dict__[name]
+
+  def _restore_attribute(self, name, value) :
+    """Restores an attribute to a logged value, without logging the change."""
+    if value is UNSET_ATTRIBUTE :
+      self.__dict__.pop(name, None)
+    else :
+      self.__dict__[name] = value
+
+  def _log_attribute_change(self, name) :
+    # Note, the log is held in a slot, outside of __dict__, and does not exist
+    # until some state has been taken that we may need to roll back to.
+    try :
+      undo_log = self._undo_log
+    except AttributeError :
+      return
+    if undo_log != None :
+      undo_log.append((name, self._get_instance_attribute(name, UNSET_ATTRIBUTE)))
+
+  def __getstate__(self) :
+    # For pickling, which would otherwise refuse a class with __slots__.  Note,
+    # there is no need to keep our log.
+    return self.__dict__
+
+  def _forget_earlier_states(self) :
+    object.__setattr__(self, "_undo_log", None)
+    for sub_container in self._containers.itervalues() :
+      sub_container._forget_earlier_states()
+
   def _get_state(self, copy_state=True) :
-    # Get our state.
-    state = [copy_state and copy.copy(self.__dict__) or self.__dict__]
+    # Start logging changes, if we are not already.
+    if getattr(self, "_undo_log", None) == None :
+      object.__setattr__(self, "_undo_log", [])
+
+    # Our state is how far through the log we are, and which containers we
+    # have, since they may be replaced when we are prepared for PUT.
+    state = [len(self._undo_log), copy.copy(self._containers)]
     
     # Then append state of our containers.
     for sub_container in self._containers.itervalues() :
@@ -641,23 +1107,134 @@ class LensObject(AbstractContainer) :
     return state
 
   def _set_state(self, state, copy_state=True) :
-    # XXX: Is there any conflict here with broad use of __dict__?
-    # Set our state.
-    self.__dict__ = copy_state and copy.copy(state[0]) or state[0]
+    # Undo attribute changes back to the state's position in our log.
+    log_position = state[0]
+    undo_log = getattr(self, "_undo_log", None) or []
+    assert_msg(log_position <= len(undo_log), "Cannot roll %s forwards to a later state." % self)
+    while len(undo_log) > log_position :
+      name, value = undo_log.pop()
+      self._restore_attribute(name, value)
+    # Note, we should not log this change.
+    object.__setattr__(self, "_containers", copy.copy(state[1]))
     
     # Then set the state of our containers.
-    i = 1
+    i = 2
     for sub_container in self._containers.itervalues() :
       sub_container._set_state(state[i], copy_state=copy_state)
       i += 1
 
 
+#
+# Slotted LensObjects, for when we must hold many model objects in memory.
+#
+
+# The instance attributes used internally by a LensObject, for which a slotted
+# class must also have slots.
+LENS_OBJECT_INTERNAL_ATTRIBUTES = [META_ATTRIBUTE, "_container_lens", "_label", "_alignment_mode", "_containers", "_constrained_attributes", "_excluded_attributes"]
+
+class SlottedLensObject(LensObject) :
+  """
+  The base of classes generated by slotted_lens_object(), whose instances hold
+  their attributes in __slots__ rather than in a __dict__.
+  """
+
+  __slots__ = ()
+
+  # These are set on each generated class: the names of its slots (other
+  # than for our undo log), also as a set, and the attributes to exclude
+  # from container state, which are the same for every instance.
+  _slot_names = ()
+  _slot_name_set = frozenset()
+  _class_excluded_attributes = []
+
+  def _set_excluded_attributes(self) :
+    self._excluded_attributes = self._class_excluded_attributes
+
+  def _get_instance_attribute(self, name, default=None) :
+    if name in self._slot_name_set :
+      return getattr(self, name, default)
+    return default
+
+  def _iterate_instance_attributes(self) :
+    attributes = []
+    for name in self._slot_names :
+      value = getattr(self, name, UNSET_ATTRIBUTE)
+      if value is not UNSET_ATTRIBUTE :
+        attributes.append((name, value))
+    return attributes
+
+  def _set_attribute(self, name, value) :
+    self._log_attribute_change(name)
+    object.__setattr__(self, name, value)
+
+  def _delete_attribute(self, name) :
+    self._log_attribute_change(name)
+    object.__delattr__(self, name)
+
+  def _restore_attribute(self, name, value) :
+    if value is not UNSET_ATTRIBUTE :
+      object.__setattr__(self, name, value)
+    elif hasattr(self, name) :
+      object.__delattr__(self, name)
+
+  def __getstate__(self) :
+    return dict(self._iterate_instance_attributes())
+
+  def __setstate__(self, state) :
+    for name, value in state.iteritems() :
+      object.__setattr__(self, name, value)
+
+  def __eq__(self, other):
+    return self.__class__ == other.__class__ and self._iterate_instance_attributes() == other._iterate_instance_attributes()
+
+
+def slotted_lens_object(cls) :
+  """
+  A class decorator that regenerates a LensObject class, which must declare
+  its attributes and containers, such that its instances hold these in
+  __slots__ rather than in a __dict__, saving much memory when there are many
+  instances.  Note that, as a result, instances may have only the declared
+  attributes and the class may not be a base of another slotted class.
+  """
+  assert_msg(issubclass(cls, LensObject), "%s must be a LensObject to be slotted." % cls)
+  container_declarations, constrained_attributes, attribute_order = cls._get_declarations()
+  assert_msg(constrained_attributes or container_declarations, "%s must declare its attributes or containers to be slotted." % cls)
+  # Any of our bases with a __dict__ would give our instances one.
+  for base in cls.__bases__ :
+    for ancestor in base.__mro__ :
+      assert_msg(ancestor is object or "__slots__" in ancestor.__dict__, "%s cannot be slotted since its base %s has no __slots__." % (cls, ancestor))
+
+  container_names = [key for key, container_properties in container_declarations]
+  slot_names = attribute_order + container_names + LENS_OBJECT_INTERNAL_ATTRIBUTES
+
+  # Copy the class, less the declarations, whose names are now slots, and
+  # anything cached on the class for the original.
+  excluded_keys = slot_names + ["__dict__", "__weakref__", "_coerced_lens", "_sub_container_tables", "_cached_identifiers", "_cached_labels", "_cached_container_class", "_cached_wrapper_class"]
+  class_dict = dict([(key, value) for key, value in cls.__dict__.iteritems() if key not in excluded_keys])
+  class_dict["__slots__"] = tuple(slot_names)
+  class_dict["_slot_names"] = tuple(slot_names)
+  class_dict["_slot_name_set"] = frozenset(slot_names)
+  class_dict["_class_excluded_attributes"] = LENS_OBJECT_INTERNAL_ATTRIBUTES + container_names
+  # Since the declarations are no longer in the class' __dict__, we cache them
+  # as if already read from there.
+  class_dict["_declarations"] = (container_declarations, constrained_attributes, attribute_order)
+
+  bases = tuple([base for base in cls.__bases__ if base is not LensObject])
+  if not [base for base in bases if issubclass(base, SlottedLensObject)] :
+    bases = (SlottedLensObject,) + bases
+  return type(cls)(cls.__name__, bases, class_dict)
+
+
 class ContainerFactory:
   """
   Used to create appropriate containers for particular types of lens.  For
   example, lens.type == dict -> container_class == DictContainer.
   """
 
+  # Maps the builtin types we have seen to their container class (or None);
+  # other types hold their own (see get_type_cache).
+  _builtin_container_classes = {}
+
   @staticmethod
   def get_container_class(incoming_type) :
     """
@@ -666,6 +1243,10 @@ class ContainerFactory:
     if incoming_type == None:
       return None
 
+    return get_type_cache(incoming_type, "_cached_container_class", ContainerFactory._find_container_class, ContainerFactory._builtin_container_classes)
+
+  @staticmethod
+  def _find_container_class(incoming_type) :
     # If type is already an AbstractContainer, return it.
     if issubclass(incoming_type, AbstractContainer) :
       return incoming_type
@@ -0,0 +1,203 @@
+#
+# Copyright (c) 2010-2011, Nick Blundell
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Nick Blundell nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# 
+#
+#
+# Author: Nick Blundell <blundeln [AT] gmail [DOT] com>
+# Organisation: www.nickblundell.org.uk
+# 
+# Description:
+#   Holds the state of a single GET or PUT call, so that lenses themselves need
+#   not hold (or alter) any state whilst they are being used.
+#
+
+import threading
+from debug import *
+from exceptions import *
+from settings import *
+
+
+class LensContext(object) :
+  """
+  The state of a single top-level GET or PUT (e.g. settings, caches and
+  counters), which is shared by all of the lenses involved in that call.
+
+  Since a context is created per call and is visible only to the thread making
+  that call, lenses themselves need hold no mutable state, so the same lens may
+  be used by several threads at once.  A context may be passed explicitly to
+  Lens.get() or Lens.put() to alter settings for a single call; otherwise a
+  default one is created, based on GlobalSettings.
+  """
+
+  def __init__(self, check_consumption=None, recursion_limit=None) :
+    """
+    Arguments:
+      check_consumption - check that the outermost lens fully consumes its
+      input and containers (defaults to GlobalSettings.check_consumption).
+      recursion_limit - if set, overrides the recursion limits of Forward lenses.
+    """
+    if check_consumption == None :
+      check_consumption = GlobalSettings.check_consumption
+    self.check_consumption = check_consumption
+    self.recursion_limit = recursion_limit
+
+    # Tracks how deeply each Forward lens is currently nested within itself,
+    # keyed by the lens, so that runaway recursion can be caught.
+    self.forward_depths = {}
+
+    # Somewhere for lenses to memoise results for the duration of the call,
+    # keyed as each lens sees fit.
+    self.caches = {}
+
+    # The alternatives being tried by lenses (e.g. Or), innermost last, to
+    # which a Commit lens may commit.
+    self.choice_points = []
+
+  def __str__(self) :
+    return "LensContext(check_consumption=%s)" % self.check_consumption
+  __repr__ = __str__
+
+
+# Keys of LensContext.caches used by the framework.
+
+# Maps a Repeat lens to records that have already been GOT in parallel, keyed
+# by their start position (see parallel.parallel_split_get).
+PRE_GOT_RECORDS = "PRE_GOT_RECORDS"
+
+# Maps (lens, document, start position, container class) to the end position
+# of input GOT by the lens, so that we may skip over it when discarding it
+# again (see Lens.get_and_discard).  The container class is part of the key,
+# since storing items in a container may itself cause a GET to fail.
+CONCRETE_SPANS = "CONCRETE_SPANS"
+
+# Maps (Or lens, document, start position) to the index of the alternative
+# that GOT input from there (see Or._get).
+OR_BRANCHES = "OR_BRANCHES"
+
+# The set of (lens, document, start position, container class) from which a
+# lens has failed to GET input that we wished to discard (see
+# Lens.get_and_discard).
+FAILED_DISCARDS = "FAILED_DISCARDS"
+
+
+# Holds the context currently in use by each thread.
+_thread_state = threading.local()
+
+def get_current_context() :
+  """Returns the context of the GET or PUT running in this thread, if any."""
+  return getattr(_thread_state, "context", None)
+
+def get_discard_key(lens, document, start_position, container) :
+  """
+  Returns the key under which GETs of the lens from this position, storing
+  items in such a container, are remembered.
+  """
+  container_class = container.__class__ if container != None else None
+  return (lens, document, start_position, container_class)
+
+def record_concrete_span(lens, document, start_position, end_position, container) :
+  """
+  Records, for the rest of the current GET or PUT, that the lens GOT input of
+  the document between these positions, storing any items in the container.
+  """
+  current_context = get_current_context()
+  if current_context == None or lens == None or document == None :
+    return
+  current_context.caches.setdefault(CONCRETE_SPANS, {})[get_discard_key(lens, document, start_position, container)] = end_position
+
+
+class lens_context:
+  """
+  Makes a context current for the duration of a 'with' block, restoring any
+  previous context afterwards (e.g. if get() is called from within a PUT).
+  """
+
+  def __init__(self, context) :
+    self.context = context
+  
+  def __enter__(self) :
+    self.previous_context = get_current_context()
+    _thread_state.context = self.context
+    return self.context
+  
+  def __exit__(self, type, value, traceback) :
+    _thread_state.context = self.previous_context
+
+  @staticmethod
+  def TESTS() :
+    outer_context = LensContext()
+    inner_context = LensContext()
+    assert(get_current_context() == None)
+    with lens_context(outer_context) :
+      assert(get_current_context() is outer_context)
+      with lens_context(inner_context) :
+        assert(get_current_context() is inner_context)
+      assert(get_current_context() is outer_context)
+    assert(get_current_context() == None)
+
+    test_description("Check contexts are not shared between threads.")
+    seen_contexts = []
+    def in_thread() :
+      seen_contexts.append(get_current_context())
+    with lens_context(outer_context) :
+      thread = threading.Thread(target=in_thread)
+      thread.start()
+      thread.join()
+    assert(seen_contexts == [None])
+
+
+class choice_point :
+  """
+  Marks, for the duration of a with block, an alternative being tried by a
+  lens (e.g. an Or lens trying one of its lenses), such that a Commit lens
+  within it may commit to it: if the alternative then fails, the lens should
+  not try any others.
+  
+  A lens that tries some lens many times but has no alternatives to commit to
+  (e.g. Until) may also use this as a barrier, so commits within do not reach
+  an outer lens.
+  """
+
+  def __init__(self) :
+    self.context = get_current_context()
+    self.committed = False
+
+  def __enter__(self) :
+    # So that we may be reused for each alternative.
+    self.committed = False
+    self.context.choice_points.append(self)
+    return self
+
+  def __exit__(self, type, value, traceback) :
+    self.context.choice_points.pop()
+
+
+def commit_to_choice_point() :
+  """Commits to the innermost alternative being tried, if there is one."""
+  choice_points = get_current_context().choice_points
+  if choice_points :
+    choice_points[-1].committed = True
+
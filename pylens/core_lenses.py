@@ -29,7 +29,6 @@
 # 
 #
 import inspect
-import sys
 from exceptions import *
 from containers import *
 from readers import *
@@ -46,6 +45,11 @@ class Forward(Lens):
   pre-processing.
   """
   def __init__(self, recursion_limit=100, **kargs):
+    """
+    Arguments:
+      recursion_limit - the maximum depth to which this lens may be nested
+      within itself during a single GET or PUT, or None for no limit.
+    """
     super(Forward, self).__init__(**kargs)
     d("Creating")
     self.recursion_limit = recursion_limit
@@ -56,27 +60,57 @@ class Forward(Lens):
     self.set_sublens(lens)
   
   def _get(self, *args, **kargs) :
-    assert_msg(len(self.lenses) == 1, "A lens has yet to be bound.")
-    return self.lenses[0]._get(*args, **kargs)
+    return self._call_bound_lens("_get", *args, **kargs)
 
   def _put(self, *args, **kargs) :
-    assert_msg(len(self.lenses) == 1, "A lens has yet to be bound.")
+    return self._call_bound_lens("_put", *args, **kargs)
+
+  def _call_bound_lens(self, function_name, *args, **kargs) :
+    """
+    Calls GET or PUT proper on the bound lens, tracking how deeply we are
+    nested within ourself.
     
-    # Ensure the recursion limit is set before we start this.
-    original_limit = sys.getrecursionlimit()
-    if self.recursion_limit :
-      sys.setrecursionlimit(self.recursion_limit)
+    Note that the depth is tracked in the context of the current call, rather
+    than by altering the interpreter's recursion limit, so lenses may safely be
+    used by several threads at once.  Since the interpreter's stack may still
+    run out first (e.g. if each recursion nests many lenses), the outermost
+    Forward lens of the call converts the resulting RuntimeError.
+    """
+    assert_msg(len(self.lenses) == 1, "A lens has yet to be bound.")
     
+    context = get_current_context()
+    recursion_limit = context.recursion_limit or self.recursion_limit
+    forward_depths = context.forward_depths
+    depth = forward_depths.get(self, 0)
+    if recursion_limit and depth >= recursion_limit :
+      raise InfiniteRecursionException("%s recursed more than %s times: you will need to alter your grammar, perhaps changing the order of Or lens operands" % (self, recursion_limit))
+    is_outermost = not any(forward_depths.itervalues())
+   
+    forward_depths[self] = depth + 1
     try :
-      output = self.lenses[0]._put(*args, **kargs)
-    except RuntimeError:
-      raise InfiniteRecursionException("You will need to alter your grammar, perhaps changing the order of Or lens operands")
+      return getattr(self.lenses[0], function_name)(*args, **kargs)
+    except RuntimeError :
+      if not is_outermost :
+        raise
+      raise InfiniteRecursionException("%s exceeded the interpreter's recursion limit: you will need to alter your grammar, perhaps changing the order of Or lens operands" % self)
     finally :
-      sys.setrecursionlimit(original_limit)
-    
-    return output
+      forward_depths[self] = depth
 
 
+  def _get_structural_key(self) :
+    # Since we bind to a lens later, we are not defined by our structure.
+    return None
+
+  def _get_nullability(self, visiting) :
+    if not self.lenses :
+      return super(Forward, self)._get_nullability(visiting)
+    return self.lenses[0].get_nullability(visiting)
+
+  def _validate(self) :
+    super(Forward, self)._validate()
+    if len(self.lenses) != 1 :
+      raise LensDefinitionException("%s has yet to be bound to a lens." % self)
+
   # Use the lshift operator, as does pyparsing, since we cannot easily override (re-)assignment.
   def __lshift__(self, other) :
     assert_msg(isinstance(other, Lens), "Can bind only to a lens.")
@@ -117,6 +151,50 @@ class Forward(Lens):
     lens = Group(lens, type=list)
     with assert_raises(InfiniteRecursionException) :
       output = lens.put(["k"])
+
+    test_description("Check the interpreter's recursion limit is caught, should we reach it first.")
+    lens = Forward()
+    lens << "[" + (And(And(lens, Empty()), Empty()) | AnyOf(alphas, type=str)) + "]"
+    lens = Group(lens, type=list)
+    with assert_raises(InfiniteRecursionException) :
+      lens.put(["k"])
+    # Also on GET, with left recursion.
+    lens = Forward()
+    lens << (And(And(lens, Empty()), Empty()) + "x" | AnyOf(alphas, type=str))
+    lens = Group(lens, type=list)
+    with assert_raises(InfiniteRecursionException) :
+      lens.get("ax")
+
+    test_description("Check the recursion limit is per lens and per call.")
+    lens = Forward(recursion_limit=3)
+    lens << "[" + (AnyOf(alphas, type=str) | lens) + "]"
+    lens = Group(lens, type=list)
+    assert(lens.get("[[[h]]]") == ["h"])
+    with assert_raises(InfiniteRecursionException) :
+      lens.get("[[[[h]]]]")
+    # The failed call should have left no trace on the next one.
+    got = lens.get("[[h]]")
+    got[0] = "p"
+    assert(lens.put(got) == "[[p]]")
+    # And a context may override the limit for a single call.
+    assert(lens.get("[[[[h]]]]", context=LensContext(recursion_limit=5)) == ["h"])
+    
+    test_description("Check the nullability of recursive lenses.")
+    lens = Forward()
+    lens << "[" + (AnyOf(alphas) | lens) + "]"
+    assert(lens.get_nullability() == Lens.NOT_NULLABLE)
+    # If we cannot be sure, we assume a recursive lens may consume nothing.
+    lens = Forward()
+    lens << (lens | Empty())
+    assert(lens.get_nullability() == Lens.NULLABLE)
+
+    # A Repeat whose lens is bound later is checked once the lens is frozen.
+    lens = Forward()
+    repeat_lens = Repeat(lens)
+    assert(repeat_lens._repeated_lens_is_nullable)
+    lens << (Empty() + Empty())
+    with assert_raises(LensDefinitionException) :
+      repeat_lens.freeze()
     
 
 class Until(Lens) :
@@ -145,11 +223,16 @@ class Until(Lens) :
     initial_position = concrete_input_reader.get_pos()
     
     stopping_lens = self.lenses[0]
+
+    # We have no alternatives to commit to, so must contain any commits of the
+    # stopping lens.
+    barrier = choice_point()
    
     while True :
       start_state = get_rollbackables_state(concrete_input_reader)
       try :
-        stopping_lens.get(concrete_input_reader)
+        with barrier :
+          stopping_lens.get(concrete_input_reader)
 
         # If we are not to include consumption of the lenes, roll back the state
         # after successfully getting the lens, since we do not want to include
@@ -228,3 +311,170 @@ class Until(Lens) :
 
     # XXX: Perhaps protect against this, or perhaps leave to lens user to worry about?!
     #assert(lens.get(lens.put(["mon)key"])) == ["monkey"])
+
+
+class Commit(Lens) :
+  """
+  Commits to the alternative being parsed by the innermost enclosing Or lens
+  (or iteration of a Repeat lens), as a "cut" in PEG parsers: should the
+  alternative fail after this lens, the Or lens fails, rather than trying its
+  other alternatives.  This can greatly reduce backtracking once we know which
+  alternative we are in.  For example:
+
+    ("iface" + Commit() + interface_options) | other_stanza
+
+  This matches no input and has no effect in the PUT direction.
+  """
+
+  def __init__(self, **kargs):
+    super(Commit, self).__init__(**kargs)
+    assert_msg(not self.has_type(), "%s cannot be a STORE lens." % self)
+    self.default = ""
+
+  def _get(self, concrete_input_reader, current_container) :
+    commit_to_choice_point()
+    return None
+
+  def _put(self, item, concrete_input_reader, current_container) :
+    if has_value(item) :
+      raise LensException("As a non-STORE lens, %s did not expect to be passed an item %s to PUT." % (self, item))
+    return ""
+
+  def _get_nullability(self, visiting) :
+    return Lens.ALWAYS_EMPTY
+
+  @staticmethod
+  def TESTS() :
+    
+    lens = Group(("a" + Commit() + AnyOf(nums, type=str)) | ("a" + AnyOf(alphas, type=str)), type=list)
+    
+    d("GET")
+    assert_equal(lens.get("a1"), ["1"])
+    # Once we match "a", the second alternative is never tried.
+    with assert_raises(LensException) :
+      lens.get("ab")
+    
+    d("PUT")
+    assert_equal(lens.put(lens.get("a1")), "a1")
+    assert_equal(lens.put(["2"], "a1"), "a2")
+    assert_equal(lens.put(["b"]), "ab")
+
+    test_description("An outer lens may still try its alternatives.")
+    outer_lens = lens | Group("ab", type=list)
+    assert_equal(outer_lens.get("ab"), [])
+
+    test_description("A committed iteration of a Repeat fails rather than stopping.")
+    lens = Repeat(Group("(" + Commit() + AnyOf(nums, type=str) + ")", type=list), type=list)
+    assert_equal(lens.get("(1)(2)"), [["1"], ["2"]])
+    with assert_raises(LensException) :
+      lens.get("(1)(x)", context=LensContext(check_consumption=False))
+    
+    test_description("Commits within the stopping lens of Until are contained.")
+    lens = Group(Until("a" + Commit() + "b", type=str) + "ab", type=list) | Repeat(AnyOf(alphas + "!", type=str), type=list)
+    assert_equal(lens.get("xacab"), ["xac"])
+    assert_equal(lens.get("xac!"), ["x", "a", "c", "!"])
+
+
+class FollowedBy(Lens) :
+  """
+  Checks, without consuming any input, that the input at the current position
+  matches the lens (or does not, if negate is set), which is cheaper than
+  parsing a whole alternative only to have it fail.  For example:
+
+    FollowedBy("iface") + interface_stanza | other_stanza
+
+  This PUTs nothing, though if there is input it is also checked, so that an
+  Or lens can choose the correct alternative.
+  """
+
+  def __init__(self, lens, negate=False, **kargs):
+    super(FollowedBy, self).__init__(**kargs)
+    assert_msg(not self.has_type(), "%s cannot be a STORE lens." % self)
+    self.set_sublens(lens)
+    self.negate = negate
+    self.default = ""
+
+  def _get(self, concrete_input_reader, current_container) :
+    self._check_input(concrete_input_reader)
+    return None
+
+  def _put(self, item, concrete_input_reader, current_container) :
+    if has_value(item) :
+      raise LensException("As a non-STORE lens, %s did not expect to be passed an item %s to PUT." % (self, item))
+    # Note, if there was no input, our default would have been used.
+    self._check_input(concrete_input_reader)
+    return ""
+
+  def _check_input(self, concrete_input_reader) :
+    """Raises a LensException if the input does not match as expected, leaving it unconsumed."""
+    start_state = get_rollbackables_state(concrete_input_reader)
+    try :
+      # We are not an alternative to commit to, so must contain any commits of
+      # our lens; also, any items are discarded, along with this container.
+      with choice_point() :
+        self.lenses[0].get(concrete_input_reader, ListContainer([]))
+      matched = True
+    except LensException :
+      matched = False
+    finally :
+      set_rollbackables_state(start_state, concrete_input_reader)
+
+    if matched and self.negate :
+      raise LensException("Expected the input not to be followed by %s." % self.lenses[0])
+    if not matched and not self.negate :
+      raise LensException("Expected the input to be followed by %s." % self.lenses[0])
+
+  def _get_nullability(self, visiting) :
+    return Lens.ALWAYS_EMPTY
+
+  @staticmethod
+  def TESTS() :
+    
+    lens = Repeat(Group(FollowedBy(AnyOf(nums)) + AnyOf(alphanums, type=str), type=list) | AnyOf(alphas), type=list)
+    
+    d("GET")
+    concrete_input_reader = ConcreteInputReader("a1b2")
+    assert_equal(lens.get(concrete_input_reader), [["1"], ["2"]])
+    assert(concrete_input_reader.is_fully_consumed())
+    # The lookahead may have a type and store items within, which are
+    # discarded.
+    lens = Group(FollowedBy(AnyOf(nums, type=str) + "0") + AnyOf(nums, type=int) + "0", type=list)
+    assert_equal(lens.get("70"), [7])
+    with assert_raises(LensException) :
+      lens.get("71")
+
+    d("PUT")
+    lens = Group((FollowedBy(AnyOf(nums)) + AnyOf(alphanums, type=str)) | (AnyOf(alphas) + AnyOf(alphanums, type=str)), type=list)
+    # With no input, the first alternative simply PUTs the item.
+    assert_equal(lens.put(["x"]), "x")
+    # But with input, the lookahead guides the choice of alternative.
+    for concrete_input, expected_output in [("ay", "ax"), ("5", "x")] :
+      got = lens.get(concrete_input)
+      got[0] = "x"
+      assert_equal(lens.put(got), expected_output)
+
+  
+class NotFollowedBy(FollowedBy) :
+  """
+  Checks, without consuming any input, that the input at the current position
+  does not match the lens.  For example:
+
+    Repeat(NotFollowedBy("end") + AnyOf(alphas))
+  """
+
+  def __init__(self, lens, **kargs):
+    super(NotFollowedBy, self).__init__(lens, negate=True, **kargs)
+
+  @staticmethod
+  def TESTS() :
+    lens = Group(Repeat(NotFollowedBy("end") + AnyOf(alphas, type=str)) + "end", type=list, combine_chars=True)
+    
+    d("GET")
+    concrete_input_reader = ConcreteInputReader("abcendx")
+    assert_equal(lens.get(concrete_input_reader), "abc")
+    assert_equal(concrete_input_reader.get_remaining(), "x")
+
+    d("PUT")
+    assert_equal(lens.put("xyz"), "xyzend")
+    assert_equal(lens.put("xy", "abcend"), "xyend")
+
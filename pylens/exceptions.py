@@ -70,6 +70,10 @@ class LensException(RollbackException):
   def __str__(self):
       return "LensException: %s" % self.__msg
 
+  def __reduce__(self) :
+    # Ensure the message survives pickling (e.g. from a worker process).
+    return (self.__class__, (self.__msg,))
+
 # Thrown when an abstract token collection cannot find an appropriate token in the
 # PUT direction.
 # Note, when deciding whether to throw a LensException or Exception it is useful
@@ -84,6 +88,9 @@ class NotFullyConsumedException(LensException): pass
 class InfiniteIterationException(LensException) : pass   #XXX Deprecated
 
 class InfiniteRecursionException(Exception): pass
+
+# Thrown when a lens is badly defined, or is changed once frozen.
+class LensDefinitionException(Exception): pass
 class CannotStoreException(Exception): pass
 
 class EndOfStringException(LensException):
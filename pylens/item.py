@@ -50,6 +50,24 @@ class float_wrapper(float) :pass
 class list_wrapper(list) :pass
 class dict_wrapper(dict) :pass
 
+# The wrappers for simple types, in the order they are checked (e.g. float
+# before int).
+WRAPPER_CLASSES = [(str, str_wrapper), (float, float_wrapper), (int, int_wrapper), (list, list_wrapper), (dict, dict_wrapper)]
+
+# Maps the builtin types of items we have seen to their wrapper class (or
+# None); other types hold their own (see get_type_cache).
+_builtin_wrapper_classes = {}
+
+def get_wrapper_class(item_type) :
+  """Returns the class to wrap an item of this type in, so it may hold meta data, if any."""
+  return get_type_cache(item_type, "_cached_wrapper_class", _find_wrapper_class, _builtin_wrapper_classes)
+
+def _find_wrapper_class(item_type) :
+  for base_type, wrapper_class in WRAPPER_CLASSES :
+    if issubclass(item_type, base_type) :
+      return wrapper_class
+  return None
+
 def item_has_meta(item) :
   return hasattr(item, META_ATTRIBUTE) 
 
@@ -67,11 +85,8 @@ def enable_meta_data(item) :
   if not item_has_meta(item) : 
     
     # Wrap simple types to allow attributes to be added to them.
-    if isinstance(item, str) : item = str_wrapper(item)
-    elif isinstance(item, float) : item = float_wrapper(item)
-    elif isinstance(item, int) : item = int_wrapper(item)
-    elif isinstance(item, list) : item = list_wrapper(item)
-    elif isinstance(item, dict) : item = dict_wrapper(item)
+    wrapper_class = get_wrapper_class(type(item))
+    if wrapper_class : item = wrapper_class(item)
    
     setattr(item, META_ATTRIBUTE, Properties())
   
@@ -91,3 +106,12 @@ def item_meta_test() :
   item._meta_data.monkeys = True
   assert(item._meta_data.monkeys == True)
   assert(item._meta_data.bananas == None)
+
+  d("Subclasses of simple types are wrapped by the type they extend")
+  class Name(str) : pass
+  assert(isinstance(enable_meta_data(Name("nick")), str_wrapper))
+  # Which is remembered by the class itself, so not beyond its lifetime.
+  assert(Name.__dict__["_cached_wrapper_class"] is str_wrapper)
+  assert(isinstance(enable_meta_data(1.5), float_wrapper))
+  assert(get_wrapper_class(bool) is int_wrapper)
+  assert(get_wrapper_class(object) == None)
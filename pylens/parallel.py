@@ -0,0 +1,313 @@
+#
+# Copyright (c) 2010-2011, Nick Blundell
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Nick Blundell nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+# 
+#
+#
+# Author: Nick Blundell <blundeln [AT] gmail [DOT] com>
+# Organisation: www.nickblundell.org.uk
+# 
+# Description:
+#   Support for GETting items in parallel, using a pool of worker processes.
+#
+
+import re
+import multiprocessing
+import cPickle as pickle
+
+from debug import *
+from exceptions import *
+from util import *
+from item import *
+from containers import *
+from readers import *
+from rollback import *
+from context import *
+from base_lenses import *
+from core_lenses import *
+
+# A record boundary at the start of any line that is not indented.
+NON_INDENTED_LINE = r"^(?=\S)"
+
+
+def get_lens_table(lens) :
+  """
+  Lists every lens of a lens graph in a fixed order, such that a lens may be
+  referred to by its index in both a parent and a worker process, each of
+  which has its own copy of the graph.
+  """
+  return list(lens._iterate_lenses())
+
+
+def iterate_meta_data(item) :
+  """
+  Yields the meta data of an item and of every item it contains (e.g. within
+  a list, dict or LensObject).
+  """
+  visited = set()
+  items_to_visit = [item]
+  while items_to_visit :
+    item = items_to_visit.pop()
+    if not item_has_meta(item) or id(item) in visited :
+      continue
+    visited.add(id(item))
+
+    meta_data = item._meta_data
+    while has_value(meta_data) :
+      yield meta_data
+      # auto_list piggybacks the meta data of a list singleton on its item.
+      meta_data = meta_data.singleton_meta_data
+
+    if isinstance(item, list) :
+      items_to_visit.extend(item)
+    elif isinstance(item, dict) :
+      items_to_visit.extend(item.values())
+    elif isinstance(item, LensObject) :
+      # Note, slotted LensObjects have no __dict__.
+      for name, value in item._iterate_instance_attributes() :
+        if not name.startswith("_") :
+          items_to_visit.append(value)
+
+
+def pack_item(item, lens_table) :
+  """
+  Replaces references in an item's meta data to the lens graph and to the
+  concrete input with small place holders, so the item may be cheaply pickled
+  and later passed to unpack_item() in another process.
+  """
+  lens_indices = dict([(id(lens), index) for index, lens in enumerate(lens_table)])
+  for meta_data in iterate_meta_data(item) :
+    if has_value(meta_data.lens) :
+      meta_data.lens = lens_indices[id(meta_data.lens)]
+    if meta_data.or_branches :
+      meta_data.or_branches = dict([(lens_indices[id(lens)], index) for lens, index in meta_data.or_branches.iteritems()])
+    # The concrete input will be reinstated from the source held by the caller.
+    meta_data.concrete_document = None
+  return item
+
+
+def unpack_item(item, lens_table, concrete_input, offset=0) :
+  """
+  Reciprocates pack_item(), so the item may be PUT as if we GOT it here.
+  Concrete positions are shifted by offset, for an item that was GOT from a
+  chunk of the concrete input.
+  """
+  concrete_document = get_concrete_document(concrete_input)
+  for meta_data in iterate_meta_data(item) :
+    if has_value(meta_data.lens) :
+      meta_data.lens = lens_table[meta_data.lens]
+    if meta_data.or_branches :
+      meta_data.or_branches = dict([(lens_table[lens_index], index) for lens_index, index in meta_data.or_branches.iteritems()])
+    if has_value(meta_data.concrete_start_position) :
+      meta_data.concrete_document = concrete_document
+      meta_data.concrete_start_position += offset
+      meta_data.concrete_end_position += offset
+  return item
+
+
+#
+# Worker process functions.
+#
+
+# The lens and lens table of a worker process, which are unpickled just once,
+# when the worker starts.
+_worker_lens = None
+_worker_lens_table = None
+
+def _initialise_worker(pickled_lens) :
+  global _worker_lens, _worker_lens_table
+  _worker_lens = pickle.loads(pickled_lens)
+  _worker_lens_table = get_lens_table(_worker_lens)
+
+def _get_in_worker(indexed_concrete_input) :
+  index, concrete_input = indexed_concrete_input
+  item = _worker_lens.get(concrete_input)
+  return index, pack_item(item, _worker_lens_table)
+
+
+def _get_records_in_worker(indexed_chunk) :
+  """
+  GETs as many records as possible from a chunk of input, returning the
+  packed items only if the whole chunk was consumed.
+  """
+  record_lens_index, start_position, chunk = indexed_chunk
+  record_lens = _worker_lens_table[record_lens_index]
+  concrete_input_reader = ConcreteInputReader(chunk)
+  record_container = ListContainer([])
+
+  # As in Repeat._get()
+  while not concrete_input_reader.is_fully_consumed() :
+    rollback_context = automatic_rollback(concrete_input_reader, record_container, check_for_state_change=True)
+    try :
+      with rollback_context :
+        record_container.get_and_store_item(record_lens, concrete_input_reader)
+    except LensException :
+      break
+    if not rollback_context.some_state_changed :
+      break
+  
+  # Note, a label would have to be set on the container of the whole document,
+  # which we leave to a sequential GET.
+  if not concrete_input_reader.is_fully_consumed() or has_value(record_container.get_label()) :
+    return start_position, None
+  
+  return start_position, [pack_item(item, _worker_lens_table) for item in record_container.unwrap()]
+
+
+def parallel_get(lens, concrete_inputs, workers=None, chunk_size=1, ordered=True) :
+  """
+  GETs an item from each of the concrete input strings with the lens, using a
+  pool of worker processes.  See pylens.get_many() for details.
+  """
+  concrete_inputs = list(concrete_inputs)
+  workers = workers or multiprocessing.cpu_count()
+
+  # It is simplest (e.g. to debug a lens) to parse in this process.
+  if workers == 1 :
+    results = ((index, lens.get(concrete_input)) for index, concrete_input in enumerate(concrete_inputs))
+    if ordered :
+      return [item for index, item in results]
+    return ParallelResults(results)
+  
+  # Note that we pickle the lens ourself, rather than with each task, so that
+  # it is shipped to each worker just once.
+  lens_table = get_lens_table(lens)
+  pool = multiprocessing.Pool(workers, _initialise_worker, (pickle.dumps(lens, pickle.HIGHEST_PROTOCOL),))
+  
+  if ordered :
+    pool_results = pool.imap(_get_in_worker, enumerate(concrete_inputs), chunk_size)
+  else :
+    pool_results = pool.imap_unordered(_get_in_worker, enumerate(concrete_inputs), chunk_size)
+
+  results = ParallelResults(((index, unpack_item(item, lens_table, concrete_inputs[index])) for index, item in pool_results), pool)
+  if ordered :
+    with results :
+      return [item for index, item in results]
+  return results
+
+
+class ParallelResults(object) :
+  """
+  Yields (index, item) pairs as they are GOT (see parallel_get), terminating
+  the pool of worker processes once all have been yielded or close() is
+  called.  Note that, should the caller stop early without calling close(),
+  the workers are left running until this is garbage collected, so it may be
+  used as a context manager: e.g.
+
+    with get_many(lens, concrete_inputs, ordered=False) as results :
+      for index, item in results :
+        ...
+  """
+
+  def __init__(self, results, pool=None) :
+    self.results = results
+    self.pool = pool
+
+  def __iter__(self) :
+    return self
+
+  def next(self) :
+    try :
+      return next(self.results)
+    except :
+      # Whether exhausted or failed, we need the workers no longer.
+      self.close()
+      raise
+
+  def close(self) :
+    """Terminates the worker processes, if still running."""
+    if self.pool :
+      self.pool.terminate()
+      self.pool.join()
+      self.pool = None
+
+  def __enter__(self) :
+    return self
+
+  def __exit__(self, type, value, traceback) :
+    self.close()
+
+  def __del__(self) :
+    self.close()
+
+
+def parallel_split_get(lens, concrete_input, boundary=NON_INDENTED_LINE, workers=None, chunk_count=None) :
+  """
+  GETs an item from a single concrete input string, where the lens is of the
+  form Group(Repeat(record)), by splitting the string into chunks at record
+  boundaries and GETting the records of each chunk in a pool of worker
+  processes.  See pylens.get_split() for details.
+  """
+  workers = workers or multiprocessing.cpu_count()
+
+  # Find the Repeat lens, whose records we will GET in parallel.
+  repeat_lens = lens
+  while not isinstance(repeat_lens, Repeat) :
+    if not (isinstance(repeat_lens, (Group, Forward)) and len(repeat_lens.lenses) == 1) :
+      raise Exception("To GET %s in parallel, it must be a Repeat of records, optionally within a Group." % lens)
+    repeat_lens = repeat_lens.lenses[0]
+  
+  # Any limit on the number of records must be handled sequentially.
+  if workers == 1 or has_value(repeat_lens.max_count) :
+    return lens.get(concrete_input)
+
+  # Split the input into chunks at boundaries roughly evenly spaced.
+  if isinstance(boundary, basestring) :
+    boundary = re.compile(boundary, re.MULTILINE)
+  chunk_count = chunk_count or workers * 4
+  target_chunk_size = max(1, len(concrete_input) / chunk_count)
+  chunk_positions = [0]
+  for match in boundary.finditer(concrete_input) :
+    if match.start() >= chunk_positions[-1] + target_chunk_size :
+      chunk_positions.append(match.start())
+  chunk_positions.append(len(concrete_input))
+  
+  # GET records from each chunk in parallel.
+  lens_table = get_lens_table(lens)
+  record_lens_index = lens_table.index(repeat_lens.lenses[0])
+  chunks = [(record_lens_index, start, concrete_input[start:end]) for start, end in zip(chunk_positions, chunk_positions[1:])]
+  pool = multiprocessing.Pool(workers, _initialise_worker, (pickle.dumps(lens, pickle.HIGHEST_PROTOCOL),))
+  try :
+    results = pool.map(_get_records_in_worker, chunks)
+  finally :
+    pool.terminate()
+    pool.join()
+
+  pre_got_records = {}
+  for (index, start, chunk), (_, items) in zip(chunks, results) :
+    if items == None :
+      d("Chunk at %s failed to parse alone, so will be parsed sequentially." % start)
+      continue
+    # Note, the Repeat lens would spin for ever on an empty chunk.
+    if not items :
+      continue
+    items = [unpack_item(item, lens_table, concrete_input, offset=start) for item in items]
+    pre_got_records[start] = (start + len(chunk), items)
+
+  # Now GET the whole input, during which the Repeat lens will simply store the
+  # records we GOT in parallel.
+  context = LensContext()
+  context.caches[(PRE_GOT_RECORDS, repeat_lens)] = pre_got_records
+  return lens.get(concrete_input, context=context)
@@ -31,12 +31,67 @@
 #   Stateful string reader classes (i.e. that can be rolled back for tentative parsing)
 #
 
+import itertools
+import weakref
 from debug import *
 from exceptions import *
 from util import *
 from containers import *
 
 
+class ConcreteDocument(object) :
+  """
+  A concrete input string, registered once in a table of documents, such that
+  items and readers refer to it and its integer id, rather than each holding a
+  reader, and such that we may cheaply check if two readers read the same
+  input.
+  """
+
+  # Note, documents should be created with get_concrete_document().
+  def __init__(self, string, document_id) :
+    self.string = string
+    self.id = document_id
+
+  def __reduce__(self) :
+    # Note, when unpickled, the document is registered afresh, perhaps with a
+    # different id.
+    return (get_concrete_document, (self.string,))
+
+  def __str__(self) :
+    return "ConcreteDocument(%s, '%s')" % (self.id, truncate(self.string))
+  __repr__ = __str__
+
+  @staticmethod
+  def TESTS() :
+    document = get_concrete_document("ABCD")
+    assert(get_concrete_document("AB" + "CD") is document)
+    assert(get_concrete_document_by_id(document.id) is document)
+    assert(get_concrete_document("ABC") is not document)
+    import pickle
+    assert(pickle.loads(pickle.dumps(document)) is document)
+
+
+# The table of documents in use, by their string and by their id.  Note, a
+# string of the same content maps to the same document.
+_documents_by_string = weakref.WeakValueDictionary()
+_documents_by_id = weakref.WeakValueDictionary()
+_document_ids = itertools.count()
+
+def get_concrete_document(string) :
+  """Returns the document of the string, registering it if necessary."""
+  document = _documents_by_string.get(string)
+  if document == None :
+    document = ConcreteDocument(string, next(_document_ids))
+    _documents_by_string[string] = document
+    _documents_by_id[document.id] = document
+  return document
+
+def get_concrete_document_by_id(document_id) :
+  """Returns the document with the id, if it is still in use."""
+  return _documents_by_id.get(document_id)
+
+
+
 class ConcreteInputReader(Rollbackable):
   """Stateful reader of the concrete input string."""
 
@@ -45,12 +100,17 @@ class ConcreteInputReader(Rollbackable):
     # If input_string is in fact a ConcreteInputReader, copy its state.
     if isinstance(input_string, self.__class__) :
       self.position = input_string.position
-      self.string = input_string.string
-    # Otherwise, initialise our state.
+      self.document = input_string.document
+    # Otherwise, initialise our state, perhaps from a document.
     else :
-      assert(isinstance(input_string, str))
+      if not isinstance(input_string, ConcreteDocument) :
+        assert(isinstance(input_string, str))
+        input_string = get_concrete_document(input_string)
       self.position  = 0
-      self.string    = input_string
+      self.document  = input_string
+    
+    # For convenience, and speed.
+    self.string = self.document.string
 
   def reset(self) :
     self.set_pos(0)
@@ -106,7 +166,12 @@ class ConcreteInputReader(Rollbackable):
 
   def is_aligned_with(self, other) :
     """Check if this reader is aligned with another."""
-    return self.position == other.position and self.string == other.string
+    return self.is_at(other.document, other.position)
+
+  def is_at(self, document, position) :
+    """Check if this reader is at the position of the document."""
+    # Note, since documents are registered once, we need not compare strings.
+    return self.position == position and self.document is document
 
   def __str__(self) :
     # Return a string representation of this reader, to help debugging.
@@ -152,5 +217,7 @@ class ConcreteInputReader(Rollbackable):
     assert(cloned_reader.is_aligned_with(concrete_reader))
     cloned_reader.position += 1
     assert(not cloned_reader.is_aligned_with(concrete_reader))
+    # Readers of equal strings read the same document.
+    assert(ConcreteInputReader("AB" + "CD").is_aligned_with(concrete_reader))
 
 
@@ -45,6 +45,9 @@ class Rollbackable(object) :
   solutions later (e.g. copy-before-modify).
   """
 
+  # Allows slotted subclasses, though by default subclasses have a __dict__.
+  __slots__ = ()
+
   # XXX: Do we always need to copy on get AND set? Have to careful that original state is not set.
   # XXX: Basically need to make sure that original state cannot be modified
   # XXX: Perhaps add copy-flag
@@ -80,6 +83,14 @@ class Rollbackable(object) :
       self.__dict__ = state
 
 
+  def _forget_earlier_states(self) :
+    """
+    Called when no state taken so far will be set again, so that a
+    rollbackable that logs its changes, rather than copying its state, may
+    discard that log.
+    """
+    pass
+
   def __eq__(self, other):
     """So we can easily compare if two objects have state of equal value."""
     # TODO: To use this is expensive and should be replaced by a more
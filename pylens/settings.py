@@ -37,6 +37,10 @@ class GlobalSettings:
   """
   These are some global settings that affect the functionality of the
   framework.
+
+  Note that these serve only as defaults for each new LensContext, so to alter
+  a setting for a single call (e.g. when lenses are shared between threads)
+  pass a LensContext to get() or put() instead.
   """
   
   """
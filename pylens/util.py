@@ -31,6 +31,8 @@
 #   Utilities of global use.
 #
 import copy
+import threading
+from collections import OrderedDict
 from debug import *
 
 
@@ -76,6 +78,106 @@ class Properties(object):
     assert(properties.nothing == None)
 
 
+class FrozenProperties(Properties) :
+  """Properties that cannot be changed once created (e.g. the options of a frozen lens)."""
+
+  def __setattr__(self, name, value) :
+    raise AttributeError("Cannot set '%s' since these properties are frozen." % name)
+  
+  def clear(self) :
+    raise AttributeError("Cannot clear these properties since they are frozen.")
+
+  @staticmethod
+  def TESTS() :
+    d("Testing")
+    properties = FrozenProperties(food="cheese")
+    assert(properties.food == "cheese" and properties.nothing == None)
+    try :
+      properties.food = "bread"
+      assert(False)
+    except AttributeError :
+      pass
+    assert(properties.food == "cheese")
+
+
+class BoundedDict(OrderedDict) :
+  """
+  A dictionary, useful as a memo, that holds at most max_size entries,
+  evicting the oldest entry to make room for a new one.
+
+  Since such memos may be shared between threads, entries are added and
+  evicted under a lock, whilst reads (e.g. with get()) need none.
+  """
+
+  def __init__(self, max_size, *args, **kargs) :
+    self.max_size = max_size
+    self._lock = threading.Lock()
+    super(BoundedDict, self).__init__(*args, **kargs)
+
+  def __setitem__(self, key, value) :
+    with self._lock :
+      if key not in self and len(self) >= self.max_size :
+        try :
+          self.popitem(last=False)
+        except KeyError :
+          pass # Emptied by other means (e.g. clear()).
+      super(BoundedDict, self).__setitem__(key, value)
+
+  @staticmethod
+  def TESTS() :
+    d("Testing")
+    memo = BoundedDict(2)
+    memo["a"], memo["b"] = 1, 2
+    memo["a"] = 3 # Should not evict, since already present.
+    assert_equal(memo.keys(), ["a", "b"])
+    memo["c"] = 4
+    assert_equal(memo.keys(), ["b", "c"])
+    assert("a" not in memo and memo["c"] == 4)
+
+    d("Testing shared between threads")
+    memo = BoundedDict(10)
+    failures = []
+    def fill(offset) :
+      try :
+        for i in range(2000) :
+          key = (offset + i) % 50
+          memo[key] = key
+          value = memo.get(key)
+          assert(value == None or value == key)
+      except Exception, e :
+        failures.append(e)
+    threads = [threading.Thread(target=fill, args=(offset,)) for offset in range(4)]
+    for thread in threads :
+      thread.start()
+    for thread in threads :
+      thread.join()
+    assert_msg(not failures, "Threads failed: %s" % failures)
+    assert_equal(len(memo), 10)
+    assert_equal(len(memo.keys()), 10)
+
+
+def get_type_cache(item_type, name, compute, builtin_type_cache) :
+  """
+  Returns compute(item_type), cached in the type's own __dict__ (so neither
+  inherited by subclasses nor outliving the type).  Builtin types, whose
+  attributes cannot be set, but which live as long as the interpreter, are
+  instead cached in builtin_type_cache.
+  """
+  try :
+    return builtin_type_cache[item_type]
+  except KeyError :
+    pass
+  if name in item_type.__dict__ :
+    return item_type.__dict__[name]
+
+  value = compute(item_type)
+  try :
+    setattr(item_type, name, value)
+  except TypeError :
+    builtin_type_cache[item_type] = value
+  return value
+
+
 def get_class_attr(obj, name, default=None):
   """Specifically get an attribute of an object's class."""
   return getattr(obj.__class__, name, default)
@@ -128,6 +230,15 @@ def has_value(var) :
 # TESTS
 #
 
+def get_type_cache_test() :
+  class Thing(object) : pass
+  class SubThing(Thing) : pass
+  builtin_type_cache = {}
+  for item_type in [Thing, SubThing, str] :
+    assert_equal(get_type_cache(item_type, "_cached_name", lambda item_type : item_type.__name__, builtin_type_cache), item_type.__name__)
+  assert_equal(SubThing.__dict__["_cached_name"], "SubThing")
+  assert_equal(builtin_type_cache, {str : "str"})
+
 def attr_test():
   test_description("Test behaviour of getattr when there is ambiguity over instance and class attributes")
   class A:
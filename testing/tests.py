@@ -64,6 +64,23 @@ def dict_test() :
   with assert_raises(NoTokenToConsumeException) :
     lens.put({"number":4, "wrong_label":"q"}, "1a")
   
+  test_description("Static labels are looked up as items are consumed and rolled back")
+  lens = Repeat(AnyOf("x", type=str, label="x") | AnyOf("y", type=str, label="y") | AnyOf(nums, type=str, label="n"), type=dict, alignment=SOURCE)
+  got = lens.get("y2x")
+  assert_equal(got, {"x":"x", "y":"y", "n":"2"})
+  got["n"] = "5"
+  assert_equal(lens.put(got), "y5x")
+  del got["y"]
+  assert_equal(lens.get(lens.put(got)), {"x":"x", "n":"5"})
+
+  # And from attributes of a LensObject.
+  class Point(LensObject) :
+    __lens__ = "(" + Word(nums, type=str, label="x") + "," + Word(nums, type=str, label="y coord") + ")"
+  point = get(Point, "(1,2)")
+  assert_equal([point.x, point.y_coord], ["1", "2"])
+  point.x, point.y_coord = "10", "20"
+  assert_equal(put(point), "(10,20)")
+  
  
   # Test dynamic labels
   key_value_lens = Group(AnyOf(alphas, type=str, is_label=True) + AnyOf("*+-", default="*") + AnyOf(nums, type=int), type=list)
@@ -105,6 +122,21 @@ def dict_test() :
   output = lens.put(got)
   assert_equal(output, "a+3z*7c*4")
 
+  test_description("With LABEL alignment, a changed item is PUT back in place.")
+  lens = Repeat(key_value_lens, type=dict, alignment=LABEL)
+  got = lens.get("a+3c-2z*7")
+  got["c"] = 4
+  assert_equal(lens.put(got), "a+3c*4z*7")
+  # Removed items are dropped, and where the input holds no item of the
+  # model, items are PUT in model order - so a new item may take the place of
+  # a removed one.  Since the order of a dict is arbitrary, so then is where
+  # the new item is PUT, though the others are PUT back unchanged.
+  got = lens.get("a+3c-2z*7")
+  got["b"] = 1
+  del got["a"]
+  output = lens.put(got)
+  assert_msg(output in ["b*1c-2z*7", "c-2b*1z*7", "c-2z*7b*1", "z*7c-2b*1"], "Unexpected output %s" % output)
+
 
 
 def consumption_test():
@@ -124,6 +156,265 @@ def consumption_test():
     lens.put([1,2,"a"], "67")
 
 
+def context_test() :
+
+  test_description("Test settings may be passed per call in a context")
+  lens = Repeat(AnyOf(nums, type=int), type=list)
+  with assert_raises(NotFullyConsumedException):
+    lens.get("123abc")
+  assert_equal(lens.get("123abc", context=LensContext(check_consumption=False)), [1,2,3])
+  assert_equal(lens.put([1,2], "123abc", context=LensContext(check_consumption=False)), "12")
+  # The global default should be untouched.
+  with assert_raises(NotFullyConsumedException):
+    lens.get("123abc")
+
+  test_description("Test a lens may be shared by several threads with differing settings")
+  import threading
+  lens = List(KeyValue(Word(alphas, is_label=True) + "=" + Word(nums, type=str)), ";", type=dict, alignment=SOURCE)
+  failures = []
+  def parse_repeatedly(check_consumption) :
+    try :
+      context = LensContext(check_consumption=check_consumption)
+      for i in range(50) :
+        if check_consumption :
+          with assert_raises(NotFullyConsumedException) :
+            lens.get("a=1;b=2;", context=context)
+        else :
+          got = lens.get("a=1;b=2;", context=context)
+          assert_equal(got, {"a":"1", "b":"2"})
+          got["a"] = "3"
+          assert_equal(lens.put(got, "a=1;b=2;", context=context), "b=2;a=3")
+    except Exception, e:
+      failures.append(e)
+
+  threads = [threading.Thread(target=parse_repeatedly, args=(i % 2 == 0,)) for i in range(4)]
+  for thread in threads :
+    thread.start()
+  for thread in threads :
+    thread.join()
+  assert_msg(not failures, "Threads failed: %s" % failures)
+
+
+def get_many_test() :
+
+  lens = List(KeyValue(Word(alphas, is_label=True) + "=" + Word(nums, type=str)), ";", type=dict, alignment=SOURCE)
+  INPUTS = ["a=1;b=2", "c=3", "d=4;e=5;f=6", "g=7"]
+  
+  test_description("GET in worker processes")
+  got = get_many(lens, INPUTS, workers=2, chunk_size=2)
+  assert_equal(got, [{"a":"1", "b":"2"}, {"c":"3"}, {"d":"4", "e":"5", "f":"6"}, {"g":"7"}])
+  
+  test_description("Check the items carry meta data sufficient to PUT")
+  # The items should refer to our own lenses, not the workers' copies.
+  from pylens.parallel import get_lens_table
+  assert(got[2]["e"]._meta_data.lens in get_lens_table(lens))
+  got[2]["e"] = "9"
+  assert_equal(put(lens, got[2]), "d=4;f=6;e=9")
+  assert_equal(put(lens, got[0]), "a=1;b=2")
+
+  test_description("GET as items are parsed")
+  got = dict(get_many(lens, INPUTS, workers=2, ordered=False))
+  assert_equal(got, dict(enumerate(get_many(lens, INPUTS, workers=1))))
+  # Should we stop early, the workers may be terminated promptly.
+  with get_many(lens, INPUTS, workers=2, ordered=False) as results :
+    index, item = next(results)
+    assert_equal(item, got[index])
+  assert(results.pool == None)
+
+  test_description("Check errors are raised from the workers")
+  with assert_raises(LensException) :
+    get_many(lens, INPUTS + ["h=not_a_number"], workers=2)
+
+
+def get_split_test() :
+
+  # Records are a name followed by indented values, one per line, then "end".
+  record = Group(Word(alphas, type=str) + NewLine() + ZeroOrMore("  " + Word(alphanums, type=str) + NewLine()) + "end" + NewLine(), type=list)
+  lens = ZeroOrMore(record, type=list)
+  
+  concrete_input = "".join(["rec%s\n  a%s\n  b%s\nend\n" % ("abcdefghij"[i], i, i) for i in range(10)])
+  
+  test_description("GET records in parallel")
+  got = get_split(lens, concrete_input, boundary=r"^rec", workers=2, chunk_count=4)
+  assert_equal(got, lens.get(concrete_input))
+  
+  test_description("Check records may be PUT back into the input")
+  got[3][1] = "changed"
+  del got[7]
+  expected = lens.get(concrete_input)
+  expected[3][1] = "changed"
+  del expected[7]
+  output = lens.put(got)
+  assert_equal(output, lens.put(expected))
+  assert("recd\n  changed\n" in output and "rech" not in output)
+
+  test_description("Chunks split within a record are GOT sequentially")
+  # Here the boundary matches every line, so most chunks will start or end
+  # mid-record.
+  got = get_split(lens, concrete_input, boundary=r"^", workers=2, chunk_count=7)
+  assert_equal(got, lens.get(concrete_input))
+
+  test_description("Check errors are as from a sequential GET")
+  lens = OneOrMore(record, type=list)
+  with assert_raises(LensException) :
+    get_split(lens, "", workers=2)
+  with assert_raises(Exception) :
+    get_split(Group(record + record, type=list), concrete_input, workers=2)
+
+
+def executor_test() :
+  
+  import StringIO
+  
+  # A minimal executor, with the interface of those in concurrent.futures.
+  class Future(object) :
+    def __init__(self, function, args, kargs) :
+      self._result = function(*args, **kargs)
+    def result(self) :
+      return self._result
+  class Executor(object) :
+    def submit(self, function, *args, **kargs) :
+      return Future(function, args, kargs)
+  
+  lens = List(KeyValue(Word(alphas, is_label=True) + "=" + Word(nums, type=str)), ";", type=dict)
+
+  test_description("GET from a file-like object and from chunks")
+  assert_equal(get_from(lens, StringIO.StringIO("a=1;b=2")), {"a":"1", "b":"2"})
+  assert_equal(get_from(lens, iter(["a=1;", "b", "=2"])), {"a":"1", "b":"2"})
+  
+  test_description("GET and PUT in an executor")
+  executor = Executor()
+  got = get_in_executor(executor, lens, ["a=1;", "b=2"]).result()
+  assert_equal(got, {"a":"1", "b":"2"})
+  got["b"] = "3"
+  writer = StringIO.StringIO()
+  assert_equal(put_in_executor(executor, lens, got, writer=writer).result(), "a=1;b=3")
+  assert_equal(writer.getvalue(), "a=1;b=3")
+
+
+def freeze_test() :
+
+  lens = Repeat(Group(AnyOf(alphas, type=str, is_label=True) + "=" + Word(nums, type=str), type=list, auto_list=True), type=dict)
+  concrete_input = "a=1b=23"
+  expected_output = put(lens, get(lens, concrete_input))
+
+  test_description("A frozen lens GETs and PUTs as before")
+  assert(lens.freeze() is lens)
+  assert(lens.is_frozen() and lens.lenses[0].lenses[0].is_frozen())
+  got = get(lens, concrete_input)
+  assert_equal(got, {"a":"1", "b":"23"})
+  assert_equal(put(lens, got), expected_output)
+  assert_equal(get_many(lens, [concrete_input], workers=2), [got])
+
+  test_description("An unfrozen lens may be changed after it is used")
+  number_lens = AnyOf(nums)
+  assert_equal(number_lens.get("1"), None)
+  number_lens.type = int
+  assert_equal(number_lens.get("1"), 1)
+
+  test_description("A frozen lens cannot be changed")
+  with assert_raises(LensDefinitionException) :
+    lens.type = list
+  with assert_raises(LensDefinitionException) :
+    lens.extend_sublenses(["x"])
+  with assert_raises(AttributeError) :
+    lens.lenses[0].options.auto_list = False
+
+  test_description("Lenses are validated when frozen")
+  lens = Forward()
+  with assert_raises(LensDefinitionException) :
+    Group("[" + lens + "]", type=list).freeze()
+  assert(not lens.is_frozen())
+  
+  # But may be frozen once bound, even if recursive.
+  lens << Group("[" + Optional(lens) + "]", type=list)
+  lens.freeze()
+  assert_equal(put(lens, get(lens, "[[]]")), "[[]]")
+  # Including typed lenses with structural defaults.
+  lens = Empty(type=str).freeze()
+  assert_equal(lens.get(""), "")
+  assert_equal(lens.put(""), "")
+  lens = Literal("x", type=str).freeze()
+  assert_equal(lens.put("x"), "x")
+
+
+def optimise_test() :
+
+  def make_lens() :
+    value = Optional(Optional(AnyOf("ab") | AnyOf("bc") | AnyOf(nums, type=str) | AnyOf("x", type=str) | Empty() | Empty()))
+    entry = Group(Word(alphas, is_label=True) + (Literal("=") + " " + Literal("[")) + value + "]", type=list)
+    return List(entry, ";", type=dict)
+
+  test_description("Check the optimised lens is simpler")
+  lens = make_lens()
+  optimised_lens = make_lens().optimise()
+  # Literals should have been merged and Ors flattened.
+  entry_lens = optimised_lens.lenses[0]
+  literals = [sublens.literal_string for sublens in entry_lens.lenses[0].lenses if isinstance(sublens, Literal)]
+  assert_equal(literals, ["= [", "]"])
+  or_lens = entry_lens.lenses[0].lenses[2]
+  # Untyped alternative sets of chars are merged, though not STORE lenses,
+  # since items refer to the lens that GOT them.
+  assert_equal([sublens.__class__ for sublens in or_lens.lenses], [AnyOf, AnyOf, AnyOf, Empty])
+  assert_equal([sublens.valid_chars for sublens in or_lens.lenses[:3]], ["abc", nums, "x"])
+  
+  test_description("Check the optimised lens GETs, PUTs and CREATEs as before")
+  concrete_input = "x= [a];y= [];z= [3];v= [x]"
+  got, optimised_got = get(lens, concrete_input), get(optimised_lens, concrete_input)
+  assert_equal(got, optimised_got)
+  for item in [got, optimised_got] :
+    item["y"] = ["5"]
+    del item["x"]
+    item["w"] = []
+  assert_equal(put(lens, got), put(optimised_lens, optimised_got))
+  assert_equal(put(lens, {"d":["x"]}), put(optimised_lens, {"d":["x"]}))
+  assert(optimised_got["v"][0]._meta_data.lens is or_lens.lenses[2])
+  
+  test_description("Check lenses with settings are not rewritten")
+  lens = Group(Literal("a", name="a") + Literal("b") + Literal("c", type=str), type=list)
+  lens.optimise()
+  assert_equal(len(lens.lenses[0].lenses), 3)
+  assert_equal(lens.lenses[0].lenses[0].name, "a")
+  assert_equal(lens.get("abc"), ["c"])
+
+  test_description("Check an And of one lens collapses to that lens")
+  literal = Literal("a")
+  assert(And(literal).optimise() is literal)
+
+
+def intern_test() :
+
+  def make_lens() :
+    return Repeat(Group(Word(alphas, is_label=True) + WS("") + "=" + WS("") + Word(nums, type=str) + NewLine(), type=list, auto_list=True), type=dict)
+
+  lens_a, lens_b = make_lens(), make_lens()
+  test_description("Identical untyped sub-lenses are shared once frozen")
+  lens_a.freeze()
+  lens_b.freeze()
+  and_a, and_b = lens_a.lenses[0].lenses[0], lens_b.lenses[0].lenses[0]
+  assert(and_a is not and_b)
+  for sublens_a, sublens_b in zip(and_a.lenses, and_b.lenses) :
+    # But not STORE lenses.
+    if sublens_a.has_type() :
+      assert(sublens_a is not sublens_b)
+    else :
+      assert(sublens_a is sublens_b)
+  
+  test_description("Shared lenses GET and PUT as before")
+  concrete_input = "a = 1\nb=2\n"
+  got = get(lens_b, concrete_input)
+  assert_equal(got, {"a":"1", "b":"2"})
+  got["b"] = "3"
+  assert_equal(put(lens_a, get(lens_a, concrete_input)), concrete_input)
+  assert_equal(put(lens_b, got), "a = 1\nb=3\n")
+
+  test_description("Lenses with equal values of differing types are not shared")
+  lenses = [Group(AnyOf(alphas, type=str) + AnyOf(nums, default=default), type=list) for default in [1, True, 1.0]]
+  outputs = [put(lens, ["x"]) for lens in lenses]
+  assert_equal(outputs, ["x1", "xTrue", "x1.0"])
+  assert_equal([put(lens.freeze(), ["x"]) for lens in lenses], outputs)
+
+
 def list_test() :
 
   lens = Repeat(AnyOf(nums, type=int), type=list)
@@ -136,6 +427,32 @@ def list_test() :
   d("GET-PUT")
   assert(lens.put(lens.get("1")) == "1")
 
+  d("PUT leaves the list intact")
+  got = lens.get("121")
+  assert_equal(lens.put(got), "121")
+  assert_equal(got, [1,2,1])
+
+  d("Items are removed from the container by identity, with rollback")
+  container = ContainerFactory.wrap_container(enable_meta_data([1, 2, 1]))
+  first, second, third = container.container_item
+  state = get_rollbackables_state(container)
+  container.remove_item(None, third)
+  assert(container.container_item[0] is first)
+  assert_equal(list(container.get_put_candidates(None, None)), [1, 2])
+  container.remove_item(None, first)
+  container.store_item(enable_meta_data(3), None, None)
+  assert_equal(container.unwrap(), [2, 3])
+  set_rollbackables_state(state, container)
+  assert_equal(container.unwrap(), [1, 2, 1])
+  assert(container.unwrap()[2] is third)
+
+  test_description("A repeated lens that stores an item but consumes no input is not repeated for ever")
+  lens = ZeroOrMore(ZeroOrMore(Literal("x"), type=list), type=list)
+  assert_equal(lens.get(""), [[]])
+  assert_equal(lens.get("xx"), [[], []])
+  with assert_raises(TooFewIterationsException) :
+    Repeat(Repeat(AnyOf("x", type=str), type=list), min_count=1, type=list).get("")
+
 
 def model_ordered_matching_list_test() :
   
@@ -202,6 +519,74 @@ def source_ordered_matching_list_test() :
   d(output)
   assert(output == "a+3c-2m*6")
 
+  d("With many items and the same new item twice")
+  concrete_input = "".join(["%s+%d" % (char, i % 10) for i, char in enumerate(alphas[:40])])
+  got = lens.get(concrete_input)
+  got.reverse()
+  del got[10] # The 30th item
+  new_item = ["m",6]
+  got.extend([new_item, new_item])
+  output = lens.put(got)
+  assert_equal(output, concrete_input[:29*3] + concrete_input[30*3:] + "m*6m*6")
+
+def discard_test() :
+  """Input GOT by a lens may later be discarded by skipping over it."""
+  lens = Group(AnyOf(alphas, type=str) + AnyOf(nums, type=int), type=list)
+  context = LensContext()
+  with lens_context(context) :
+    # The input is GOT, and the span then recorded for the rest of the call.
+    concrete_input_reader = ConcreteInputReader("a1b2")
+    lens.get_and_discard(concrete_input_reader, None)
+    assert_equal(concrete_input_reader.get_pos(), 2)
+    assert_equal(context.caches[CONCRETE_SPANS], {(lens, concrete_input_reader.document, 0, None) : 2})
+    # So a reader of an equal string may skip over it.
+    concrete_input_reader = ConcreteInputReader("a1b2")
+    lens.get_and_discard(concrete_input_reader, None)
+    assert_equal(concrete_input_reader.get_pos(), 2)
+
+  # Spans of the items being PUT are known from their meta data, and nothing
+  # outlives the call.
+  got = lens.get("a1")
+  context = LensContext()
+  assert_equal(lens.put(got, "a1", context=context), "a1")
+  assert_equal(context.caches[CONCRETE_SPANS][(lens, got._meta_data.concrete_document, 0, None)], 2)
+  assert(not hasattr(got._meta_data.concrete_document, "spans"))
+
+  # Within a GET or PUT, failures to discard are remembered too.
+  context = LensContext()
+  with lens_context(context) :
+    concrete_input_reader = ConcreteInputReader("1ab2")
+    with assert_raises(LensException) :
+      lens.get_and_discard(concrete_input_reader, None)
+    assert_equal(context.caches[FAILED_DISCARDS], set([(lens, concrete_input_reader.document, 0, None)]))
+    with assert_raises(LensException) :
+      lens.get_and_discard(concrete_input_reader, None)
+
+  # Though what is known of a lens storing into one kind of container does not
+  # hold for another, which may reject its items.
+  unlabelled_lens = AnyOf(alphas, type=str) + AnyOf(nums)
+  with lens_context(LensContext()) :
+    concrete_input_reader = ConcreteInputReader("a1")
+    unlabelled_lens.get_and_discard(concrete_input_reader, ListContainer([]))
+    concrete_input_reader = ConcreteInputReader("a1")
+    with assert_raises(LensException) :
+      unlabelled_lens.get_and_discard(concrete_input_reader, DictContainer({}))
+  # Nor does a failure into one kind of container hold for another.
+  with lens_context(LensContext()) :
+    concrete_input_reader = ConcreteInputReader("a1")
+    with assert_raises(LensException) :
+      unlabelled_lens.get_and_discard(concrete_input_reader, DictContainer({}))
+    concrete_input_reader = ConcreteInputReader("a1")
+    unlabelled_lens.get_and_discard(concrete_input_reader, ListContainer([]))
+    assert_equal(concrete_input_reader.get_pos(), 2)
+
+  # Deleted items are discarded when PUT.
+  lens = Repeat(lens, type=list, alignment=SOURCE)
+  got = lens.get("a1b2c3")
+  del got[1]
+  assert_equal(lens.put(got), "a1c3")
+
+
 def state_recovery_test():
 
   test_description("Test that the user's item's state is recovered after consumption.")
@@ -269,6 +654,65 @@ def lens_object_test():
   # If all went well, we should GET back what we PUT.
   assert(got_person.name == "james" and got_person.last_name == "bond")
  
+  test_description("Attribute changes are rolled back from a log")
+  state = person._get_state()
+  person.name = "bob"
+  del person.last_name
+  person.age = "old"
+  person._set_state(state)
+  assert(person.name == "nick" and person.last_name == "blundell" and not hasattr(person, "age"))
+  assert_equal(put(person), "Person::Name:nick;Last   Name:blundell")
+
+  test_description("Label mappings are remembered for the class")
+  assert_equal(person.map_label_to_identifier("Last   Name"), "last_name")
+  assert_equal(Person.__dict__["_cached_labels"]["last_name"], "Last   Name")
+  assert_equal(person.map_identifier_to_label("last_name"), "Last   Name")
+  assert("_cached_labels" not in LensObject.__dict__)
+  # Every label is remembered, though conversions are memoised only for the
+  # most recent ones.
+  class Settings(LensObject) :
+    __lens__ = ZeroOrMore(KeyValue(Word(alphas + " ", is_label=True) + "=" + Word(nums, type=str) + NL()))
+  import itertools
+  keys = ["".join(letters) for letters in itertools.product("ABCDEFGHIJK", repeat=3)][:MAX_CACHED_LABELS + 100]
+  get(Settings, "".join(["Key %s=1\n" % key for key in keys]))
+  settings = Settings()
+  settings.key_aaa = "5"
+  assert_equal(put(settings), "Key AAA=5\n")
+  # Items with static labels are found for PUT under overloaded identifiers.
+  class Options(LensObject) :
+    __lens__ = "name=" + Word(alphas, type=str, label="name") + NewLine()
+    def map_label_to_identifier(self, label) :
+      return "opt_" + label
+  options = get(Options, "name=xyz\n")
+  assert_equal(options.opt_name, "xyz")
+  assert_equal(put(options), "name=xyz\n")
+ 
+  test_description("Check the lens of the class is built just once")
+  assert(Lens._coerce_to_lens(Person) is Lens._coerce_to_lens(Person))
+  # But is rebuilt should the class' lens be replaced.
+  lens = Lens._coerce_to_lens(Person)
+  Person.__lens__ = Person.__lens__ + Optional(";")
+  assert(Lens._coerce_to_lens(Person) is not lens)
+  assert_equal(put(get(Person, "Person::Name:nick;")), "Person::Name:nick;")
+
+  test_description("Items are dispatched to sub containers by lens and type")
+  class Collection(LensObject) :
+    number_lens = AnyOf(nums, type=int)
+    __lens__ = ZeroOrMore(number_lens + ",") + ZeroOrMore(AnyOf(alphas, type=str) + ";")
+    numbers = Container(store_items_from_lenses=[number_lens], type=list)
+    words = Container(store_items_of_type=[str], type=list)
+
+  collection = get(Collection, "1,2,a;b;")
+  assert_equal(collection.numbers, [1, 2])
+  assert_equal(collection.words, ["a", "b"])
+  collection.words.append("c")
+  collection.numbers.pop(0)
+  assert_equal(put(collection), "2,a;b;c;")
+  # Again, to check the state of the sub containers was restored.
+  assert_equal(put(collection), "2,a;b;c;")
+  # The dispatch tables are built once, for the class.
+  assert("_sub_container_tables" in Collection.__dict__)
+ 
 
 def constrained_lens_object_test():
   """
@@ -277,6 +721,55 @@ def constrained_lens_object_test():
   return # TODO
   
 
+# Note, this is declared at module level, so that its instances may be
+# pickled to and from worker processes.
+@slotted_lens_object
+class Rule(LensObject) :
+  __lens__ = Word(alphas, type=str, label="action") + WS(" ") + Word(nums, type=str, label="port") + NL()
+  action = Attribute()
+  port = Attribute()
+
+def slotted_lens_object_test() :
+  """
+  Here we generate a slotted LensObject class from its declared attributes,
+  whose instances have no __dict__, for when we must hold many of them.
+  """
+  test_description("GET and PUT")
+  rule = get(Rule, "allow 22\n")
+  assert(rule.action == "allow" and rule.port == "22")
+  assert(not hasattr(rule, "__dict__"))
+  rule.port = "80"
+  assert_equal(put(rule), "allow 80\n")
+  assert(rule.action == "allow" and rule.port == "80")
+  assert_equal(copy.copy(rule), rule)
+
+  test_description("CREATE")
+  rule = Rule()
+  rule.action, rule.port = "deny", "8"
+  assert_equal(put(rule), "deny 8\n")
+
+  test_description("Only the declared attributes may be set")
+  try :
+    rule.protocol = "tcp"
+    assert(False)
+  except AttributeError :
+    pass
+  
+  test_description("Many rules")
+  rules = get(ZeroOrMore(Rule, type=list), "allow 22\ndeny 23\n")
+  assert_equal([rule.port for rule in rules], ["22", "23"])
+  rules.reverse()
+  rules[0].action = "allow"
+  assert_equal(put(ZeroOrMore(Rule, type=list), rules), "allow 23\nallow 22\n")
+
+  test_description("GET in worker processes")
+  lens = ZeroOrMore(Rule, type=list)
+  got = get_many(lens, ["allow 22\n", "deny 23\nallow 1\n"], workers=2)
+  assert_equal([[rule.port for rule in rules] for rules in got], [["22"], ["23", "1"]])
+  got[1][0].port = "5"
+  assert_equal(put(lens, got[1]), "deny 5\nallow 1\n")
+
+
 def advanced_lens_object_test() :
   # Ref: http://manpages.ubuntu.com/manpages/hardy/man5/interfaces.5.html
   INPUT = """